@@ -0,0 +1,216 @@
+"""Versioned JSON API (``/api/v1``) for the catalogue, members and loans.
+
+These are read-only twins of the listing, detail and report pages, for
+kiosk and mobile clients. Listings take the same filters and ``?after=``
+cursor as their pages (see listings.py). They also take ``?fields=`` to
+pick the fields returned, e.g. ``?fields=id,title,status``.
+
+Every response carries an ETag built from the version counters of the
+tables it reads (see ``store.Table.version``). A client that sends the
+ETag back in If-None-Match gets 304 Not Modified while those tables are
+unchanged. In that case the view does not run, so there is no query and
+no serialization. With several workers the counters are the change log's
+sequence numbers instead (see shared.py), so every worker agrees.
+
+The lookup routes feed the typeahead boxes of the borrow and hold forms:
+records whose title or name starts with ``?q=``, from a prefix index
+(see search.py). Their bodies are also kept in the page cache, stamped
+with the same table versions, so repeated keystrokes cost a cache hit.
+"""
+import json
+import os
+from datetime import date
+from functools import wraps
+
+from flask import abort, current_app, jsonify, request
+
+from app import app
+from cache import cached_text
+from enrich import LoanView
+from forms import book_label, member_label
+from listings import books_page, members_page, borrowings_page, overdue_page, available_page
+from models import Book, Member, Borrowing, ACTIVE
+from search import prefix_matches
+
+# Changes on every start, so an ETag from before a restart never matches
+# even though the version counters start again from zero
+EPOCH = os.urandom(4).hex()
+
+BOOK_FIELDS = tuple(Book.fields)
+MEMBER_FIELDS = tuple(Member.fields)
+LOAN_FIELDS = tuple(Borrowing.fields) + ("book_title", "member_name")
+OVERDUE_FIELDS = LOAN_FIELDS + ("book_author", "member_email", "member_phone", "days_overdue", "fine_owed")
+
+# Matches per lookup, and index entries read at most to find them
+LOOKUP_LIMIT = 10
+MAX_LOOKUP_LIMIT = 50
+LOOKUP_SCAN = 2000
+
+
+def conditional(*tables, daily=False):
+    """Answer If-None-Match from the versions of ``tables`` (config keys).
+
+    ``daily`` adds today's date to the ETag, for responses that change at
+    midnight without any write (the overdue report).
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # Read the versions before the data: a write that lands in
+            # between changes the next ETag, so the client cannot keep
+            # stale data
+            feed = app.config["FEED"]
+            if feed is None:
+                parts = [EPOCH] + [str(app.config[table].version) for table in tables]
+            else:
+                parts = [feed.epoch] + [str(feed.version(app.config[table])) for table in tables]
+            if daily:
+                parts.append(date.today().isoformat())
+            etag = ".".join(parts)
+            if request.if_none_match.contains_weak(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = view(*args, **kwargs)
+            response.set_etag(etag, weak=True)
+            # Clients may keep the body, but must revalidate before using it
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
+
+
+def error(status, message):
+    """Stop the request with a JSON error body."""
+    response = jsonify(error=message)
+    response.status_code = status
+    abort(response)
+
+
+def selected_fields(allowed):
+    """The fields named by ``?fields=``, or all of ``allowed``."""
+    names = [name.strip() for name in request.args.get("fields", "").split(",") if name.strip()]
+    unknown = [name for name in names if name not in allowed]
+    if unknown:
+        error(400, f"Unknown field(s): {', '.join(unknown)}")
+    return names or allowed
+
+
+def serialize(record, fields):
+    item = {}
+    for name in fields:
+        value = getattr(record, name)
+        item[name] = value.isoformat() if isinstance(value, date) else value
+    return item
+
+
+def listing(page, allowed):
+    fields = selected_fields(allowed)
+    return jsonify(
+        items=[serialize(record, fields) for record in page.items],
+        total=page.total,
+        next_cursor=page.next_cursor,
+        next=page.next_url
+    )
+
+
+def detail(record, allowed, kind):
+    if record is None:
+        error(404, f"{kind} not found")
+    return jsonify(serialize(record, selected_fields(allowed)))
+
+
+@app.route('/api/v1/books')
+@conditional("BOOKS")
+def api_books():
+    return listing(books_page(), BOOK_FIELDS)
+
+
+@app.route('/api/v1/books/<int:id>')
+@conditional("BOOKS")
+def api_book(id):
+    return detail(app.config["BOOKS"].get(id), BOOK_FIELDS, "Book")
+
+
+@app.route('/api/v1/members')
+@conditional("MEMBERS")
+def api_members():
+    return listing(members_page(), MEMBER_FIELDS)
+
+
+@app.route('/api/v1/members/<int:id>')
+@conditional("MEMBERS")
+def api_member(id):
+    return detail(app.config["MEMBERS"].get(id), MEMBER_FIELDS, "Member")
+
+
+@app.route('/api/v1/borrowings')
+@conditional("BORROWINGS", "BOOKS", "MEMBERS")
+def api_borrowings():
+    return listing(borrowings_page(), LOAN_FIELDS)
+
+
+@app.route('/api/v1/borrowings/<int:id>')
+@conditional("BORROWINGS", "BOOKS", "MEMBERS")
+def api_borrowing(id):
+    loan = app.config["BORROWINGS"].get(id)
+    if loan is not None:
+        loan = LoanView(
+            loan,
+            app.config["BOOKS"].get(loan.book_id),
+            app.config["MEMBERS"].get(loan.member_id)
+        )
+    return detail(loan, LOAN_FIELDS, "Borrowing")
+
+
+@app.route('/api/v1/reports/overdue')
+@conditional("BORROWINGS", "BOOKS", "MEMBERS", daily=True)
+def api_reports_overdue():
+    return listing(overdue_page(), OVERDUE_FIELDS)
+
+
+@app.route('/api/v1/reports/available')
+@conditional("BOOKS")
+def api_reports_available():
+    return listing(available_page(request.args.get('category', '')), BOOK_FIELDS)
+
+
+def lookup(table, index, label, where=None):
+    """Typeahead matches for ``?q=`` from ``table`` (a config key) as
+    ``{"items": [{"id": ..., "label": ...}]}``, cached until it changes.
+
+    A number also matches the record with that id, first.
+    """
+    query = request.args.get("q", "").strip()
+    limit = max(1, min(request.args.get("limit", LOOKUP_LIMIT, type=int), MAX_LOOKUP_LIMIT))
+
+    def render():
+        records = app.config[table]
+        found = prefix_matches(records.indexes[index], query, limit, where, LOOKUP_SCAN)
+        if query.isdigit():
+            record = records.get(int(query))
+            if record is not None and (where is None or where(record)):
+                found = [record] + [r for r in found if r is not record][:limit - 1]
+        return json.dumps({"items": [{"id": r.id, "label": label(r)} for r in found]})
+
+    key = (request.path, query.lower(), limit, request.args.get("status", ""))
+    return current_app.response_class(
+        cached_text(key, (table,), render), mimetype="application/json"
+    )
+
+
+@app.route('/api/v1/lookup/books')
+@conditional("BOOKS")
+def api_lookup_books():
+    """Titles starting with ``?q=``; ``?status=Available`` or ``Borrowed``
+    keeps only titles with or without a copy on the shelf."""
+    status = request.args.get("status")
+    where = (lambda book: book.status == status) if status else None
+    return lookup("BOOKS", "title_prefix", book_label, where)
+
+
+@app.route('/api/v1/lookup/members')
+@conditional("MEMBERS")
+def api_lookup_members():
+    """Active members whose name starts with ``?q=``."""
+    return lookup("MEMBERS", "name_prefix", member_label,
+                  lambda member: member.membership_status == ACTIVE)
@@ -0,0 +1,78 @@
+"""Measure bulk import and export throughput in rows per second.
+
+Usage: python benchmarks/bench_import.py [ROWS] [--format csv|jsonl]
+
+Posts a synthetic catalogue of ROWS books (default 100k) to ``/import``
+through the test client, then streams it back out of ``/export``. Set
+DATABASE_URL to include the cost of a storage backend, e.g.
+``DATABASE_URL=sqlite:////tmp/bench.db``.
+"""
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import app  # noqa: E402
+
+WORDS = "python flask web data science history art garden music ocean".split()
+
+
+def make_file(rows, format, seed=42):
+    rng = random.Random(seed)
+    out = io.StringIO()
+    if format == "csv":
+        out.write("title,author,isbn,category,published_year,description\n")
+    for i in range(rows):
+        book = {
+            "title": " ".join(rng.choice(WORDS) for _ in range(3)).title(),
+            "author": f"Author {rng.randrange(1000)}",
+            "isbn": f"978-{rng.randrange(10**9, 10**10)}",
+            "category": rng.choice(WORDS).title(),
+            "published_year": rng.randint(1900, 2020),
+            "description": "",
+        }
+        if format == "csv":
+            out.write(",".join(str(value) for value in book.values()) + "\n")
+        else:
+            out.write(json.dumps(book) + "\n")
+    return out.getvalue().encode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("rows", type=int, nargs="?", default=100_000)
+    parser.add_argument("--format", choices=("csv", "jsonl"), default="csv")
+    args = parser.parse_args()
+
+    app.config["WTF_CSRF_ENABLED"] = False
+    client = app.test_client()
+    data = make_file(args.rows, args.format)
+
+    start = time.perf_counter()
+    response = client.post(
+        "/import",
+        data={"kind": "books", "file": (io.BytesIO(data), f"books.{args.format}")},
+        content_type="multipart/form-data",
+        headers={"Accept": "application/json"},
+    )
+    elapsed = time.perf_counter() - start
+    report = response.get_json()
+    print(f"import  {report['imported']:>9,} rows  {elapsed:7.2f}s  "
+          f"{report['imported'] / elapsed:>10,.0f} rows/s  ({report['failed']} rejected)")
+
+    start = time.perf_counter()
+    response = client.get(f"/export/books.{args.format}")
+    size = sum(len(chunk) for chunk in response.response)
+    elapsed = time.perf_counter() - start
+    rows = len(app.config["BOOKS"])
+    print(f"export  {rows:>9,} rows  {elapsed:7.2f}s  {rows / elapsed:>10,.0f} rows/s  "
+          f"({size / 2**20:.1f} MiB)")
+
+
+if __name__ == "__main__":
+    main()
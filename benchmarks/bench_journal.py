@@ -0,0 +1,136 @@
+"""Measure the journal backend: write overhead and startup replay time.
+
+Usage: python benchmarks/bench_journal.py [--records N] [--tail N] [--writes N]
+
+Writes: ``--writes`` book status updates, each its own transaction
+followed by ``sync()`` as the app does, from 1, 8 and 32 threads. Runs
+against the memory backend (no durability) and the journal, and reports
+microseconds per mutation and fsyncs per mutation. With more threads,
+writers share fsyncs (group commit).
+
+Startup: ``--records`` synthetic records (15% books, 5% members, 80%
+loans, from datagen.py) are written as a snapshot, followed by ``--tail``
+journaled updates. Then a fresh backend replays them and the tables are
+rebuilt, which is what the app does at startup; both steps are timed.
+Replay time grows linearly with the record count, so the 10M figure can
+be read off a smaller run.
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datagen import make_books, make_members, make_loans  # noqa: E402
+from journal import JournalBackend  # noqa: E402
+from models import Book, Member, Borrowing  # noqa: E402
+from storage import MemoryBackend, load_table  # noqa: E402
+from store import Table  # noqa: E402
+
+MODELS = (Book, Member, Borrowing)
+
+
+def bench_writes(backend, writes, threads):
+    lock = threading.RLock()
+    books = Table("books", make_books(range(1, 1001), set(), random.Random(1)),
+                  backend=backend, lock=lock)
+    per_thread = writes // threads
+    fsyncs = getattr(backend, "fsyncs", 0)
+
+    def work(seed):
+        rng = random.Random(seed)
+        for _ in range(per_thread):
+            book = books.get(rng.randint(1, 1000))
+            with lock, backend.transaction():
+                books.update(book, status="Borrowed" if book.status == "Available" else "Available")
+            backend.sync()
+
+    workers = [threading.Thread(target=work, args=(seed,)) for seed in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    done = per_thread * threads
+    return elapsed / done * 1e6, (getattr(backend, "fsyncs", 0) - fsyncs) / done
+
+
+def build(directory, records, tail, seed=1):
+    rng = random.Random(seed)
+    today = date.today()
+    counts = int(records * 0.15), int(records * 0.05)
+    loans = records - sum(counts)
+    book_ids = range(1, counts[0] + 1)
+    member_ids = list(range(1, counts[1] + 1))
+    lent = set(rng.sample(book_ids, counts[0] // 10))
+    backend = JournalBackend(directory)
+    for model in MODELS:
+        backend.create(model)
+    tables = [
+        Table("books", make_books(book_ids, lent, rng)),
+        Table("members", make_members(member_ids, rng, today)),
+        Table("borrowings", make_loans(range(1, loans + 1), list(book_ids), member_ids,
+                                       lent, 0.2, rng, today)),
+    ]
+    backend.attach(*tables)
+    backend.snapshot()
+    # Updates after the snapshot land in the journal and are replayed on top
+    books = tables[0]
+    books.backend = backend
+    for _ in range(tail):
+        book = books.get(rng.choice(book_ids))
+        with backend.transaction():
+            books.update(book, published_year=book.published_year + 1)
+    backend.close()
+
+
+def bench_startup(directory):
+    start = time.perf_counter()
+    backend = JournalBackend(directory)
+    loaded = [load_table(backend, model) for model in MODELS]
+    replayed = time.perf_counter()
+    tables = [Table(model.table, records) for model, records in zip(MODELS, loaded)]
+    built = time.perf_counter()
+    return sum(len(t) for t in tables), replayed - start, built - replayed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=1_000_000)
+    parser.add_argument("--tail", type=int, default=100_000, help="journaled updates after the snapshot")
+    parser.add_argument("--writes", type=int, default=4000)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="bench-journal-")
+    try:
+        print("writes      threads   us/mutation   fsyncs/mutation")
+        for threads in (1, 8, 32):
+            for name, backend in (("memory", MemoryBackend()),
+                                  ("journal", JournalBackend(os.path.join(directory, f"w{threads}")))):
+                backend.create(Book)
+                us, fsyncs = bench_writes(backend, args.writes, threads)
+                print(f"{name:10} {threads:8} {us:13.1f} {fsyncs:17.3f}")
+
+        path = os.path.join(directory, "startup")
+        start = time.perf_counter()
+        build(path, args.records, args.tail)
+        print(f"\nwrote {args.records:,} records + {args.tail:,} journaled updates "
+              f"in {time.perf_counter() - start:.1f}s, "
+              f"{sum(e.stat().st_size for e in os.scandir(path)) / 2**20:.0f} MiB")
+        count, replay, tables = bench_startup(path)
+        per = (replay + tables) / count
+        print(f"startup: replay {replay:.2f}s + tables {tables:.2f}s for {count:,} records "
+              f"({per * 1e6:.2f} us/record, about {per * 10_000_000:.0f}s for 10M)")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
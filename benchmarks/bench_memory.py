@@ -0,0 +1,55 @@
+"""Measure the memory cost of one stored book: plain dict vs. slot record.
+
+Usage: python benchmarks/bench_memory.py [SIZE]
+
+Builds SIZE books (default 1M) twice, once as the dicts the tables used
+to hold and once as ``models.Book`` instances, and reports the traced
+allocation per record for each. Field values are built the same way for
+both, so the difference is the per-record container overhead plus the
+interned category and status strings.
+"""
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import Book  # noqa: E402
+
+WORDS = "python flask web data science history art garden music ocean".split()
+
+
+def fields(n, seed=42):
+    rng = random.Random(seed)
+    for i in range(1, n + 1):
+        yield dict(
+            id=i,
+            title=" ".join(rng.choice(WORDS) for _ in range(3)).title(),
+            author=f"Author {rng.randrange(1000)}",
+            isbn=f"978-{rng.randrange(10**9, 10**10)}",
+            # Fresh string objects per row, as a form submission gives
+            category=rng.choice(WORDS).title(),
+            published_year=rng.randint(1900, 2024),
+            status=rng.choice(("available", "borrowed")).title(),
+            description="",
+        )
+
+
+def measure(build, size):
+    tracemalloc.start()
+    records = [build(row) for row in fields(size)]
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del records
+    return used / size
+
+
+if __name__ == "__main__":
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    as_dict = measure(dict, size)
+    as_slots = measure(lambda row: Book(**row), size)
+    print(f"{size:,} books")
+    print(f"  dict      {as_dict:8.1f} bytes/record  {as_dict * size / 2**20:8.1f} MiB")
+    print(f"  __slots__ {as_slots:8.1f} bytes/record  {as_slots * size / 2**20:8.1f} MiB")
+    print(f"  saved     {1 - as_slots / as_dict:8.1%}")
@@ -0,0 +1,82 @@
+"""Compare catalogue search latency: linear scan vs. TextIndex.
+
+Usage: python benchmarks/bench_search.py [SIZE ...]
+
+Builds a synthetic catalogue of each size (default 10k, 100k and 1M
+books), then times the old ``query in field.lower()`` scan against
+``TextIndex.search`` for a mix of short, word and prefix queries.
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import Book  # noqa: E402
+from search import TextIndex  # noqa: E402
+from store import Table  # noqa: E402
+
+WORDS = (
+    "python flask web data science history art garden music ocean river "
+    "mountain kitchen travel design network security cloud poetry war peace "
+    "night day light shadow stone glass iron silver golden hidden lost"
+).split()
+NAMES = "smith doe johnson brown garcia miller davis wilson moore taylor".split()
+QUERIES = ["py", "ocean", "golden riv", "978-12", "smith", "zzz", "ig"]
+
+
+def make_books(n, seed=42):
+    rng = random.Random(seed)
+    for i in range(1, n + 1):
+        yield Book(
+            id=i,
+            title=" ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 5))).title(),
+            author=f"{rng.choice(NAMES).title()} {rng.choice(NAMES).title()}",
+            isbn=f"978-{rng.randrange(10**9, 10**10)}",
+            category=rng.choice(WORDS).title(),
+            published_year=rng.randint(1900, 2024),
+        )
+
+
+def scan(books, query):
+    query = query.lower()
+    return [
+        book for book in books
+        if query in book.title.lower()
+        or query in book.author.lower()
+        or query in book.isbn.lower()
+    ]
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def run(size):
+    books = Table("books", make_books(size))
+    start = time.perf_counter()
+    index = books.add_index("text", TextIndex({"title": 3, "author": 2, "isbn": 1}))
+    build = time.perf_counter() - start
+    print(f"\n{size:,} books (index build {build:.2f}s)")
+    print(f"  {'query':<12}{'matches':>10}{'scan ms':>12}{'index ms':>12}{'speedup':>10}")
+    repeat = 3 if size >= 1_000_000 else 5
+    for query in QUERIES:
+        scan_s, expected = timed(lambda: scan(books, query), repeat)
+        index_s, ids = timed(lambda: index.search(query), repeat)
+        assert len(ids) == len(expected), query
+        print(
+            f"  {query!r:<12}{len(ids):>10,}{scan_s * 1e3:>12.2f}"
+            f"{index_s * 1e3:>12.2f}{scan_s / max(index_s, 1e-9):>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+    for size in sizes:
+        run(size)
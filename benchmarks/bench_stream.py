@@ -0,0 +1,73 @@
+"""Compare paged and streamed listings: time to first byte, total time, memory.
+
+Usage: python benchmarks/bench_stream.py [--loans N] [--books N] [--members N]
+
+Seeds ``datagen.seed_app`` data, then for each listing fetches one full
+page of ``MAX_PAGE_SIZE`` rows and the whole listing with ``?stream=1``,
+straight through the WSGI app so each chunk is timed as it arrives.
+Reports the time to the first chunk, the total time, the rows and bytes
+sent, and the peak memory allocated while serving the request
+(tracemalloc). A paged request's memory grows with its page size; a
+streamed one stays flat however many rows it sends.
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import app  # noqa: E402
+from datagen import seed_app  # noqa: E402
+from werkzeug.test import EnvironBuilder  # noqa: E402
+
+URLS = ["/borrow", "/books", "/members", "/reports/overdue", "/reports/available"]
+
+
+def fetch(path, query):
+    environ = EnvironBuilder(path=path, query_string=query).get_environ()
+    tracemalloc.start()
+    start = time.perf_counter()
+    first = None
+    size = 0
+    body = app.wsgi_app(environ, lambda status, headers: None)
+    try:
+        for chunk in body:
+            if first is None:
+                first = time.perf_counter() - start
+            size += len(chunk)
+    finally:
+        if hasattr(body, "close"):
+            body.close()
+    total = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return first, total, size, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--books", type=int, default=20_000)
+    parser.add_argument("--members", type=int, default=5_000)
+    parser.add_argument("--loans", type=int, default=200_000)
+    args = parser.parse_args()
+
+    # Measure rendering, not the page cache
+    app.config["PAGE_CACHE"] = None
+    start = time.perf_counter()
+    seed_app(app, books=args.books, members=args.members, loans=args.loans)
+    print(f"seeded {args.books:,} books, {args.members:,} members, {args.loans:,} loans "
+          f"in {time.perf_counter() - start:.1f}s\n")
+
+    page = app.config["MAX_PAGE_SIZE"]
+    print(f"{'listing':20} {'mode':12} {'first byte':>11} {'total':>10} {'KiB sent':>10} {'peak KiB':>10}")
+    for path in URLS:
+        for mode, query in ((f"page of {page}", f"per_page={page}"), ("stream", "stream=1")):
+            first, total, size, peak = fetch(path, query)
+            print(f"{path:20} {mode:12} {first * 1000:9.1f}ms {total * 1000:8.0f}ms "
+                  f"{size / 1024:10.0f} {peak / 1024:10.0f}")
+
+
+if __name__ == "__main__":
+    main()
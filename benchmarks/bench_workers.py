@@ -0,0 +1,207 @@
+"""Read throughput of gunicorn with 1 to N worker processes on one database.
+
+Usage: python benchmarks/bench_workers.py [--workers 1,2,4] [--seconds 10]
+                                          [--clients N] [--writes-per-second 5]
+
+Seeds a fresh SQLite database with ``datagen.seed_app`` data, then for
+each worker count starts ``gunicorn -c gunicorn.conf.py`` on it and has
+``--clients`` load processes loop over the read-heavy routes in ``URLS``
+for ``--seconds``. Each client opens a new connection every
+``PER_CONNECTION`` requests, so the load spreads over all the workers.
+Prints requests per second, the speedup over one worker and the
+latency percentiles.
+
+With ``--writes-per-second``, this process edits book descriptions
+through its own copy of the app while the clients read. Every worker
+then has to notice the writes and drop its cached pages (see shared.py),
+which is the cost the shared mode adds to reads.
+
+After each run the script adds a member and fetches it through many new
+connections. Every worker must return it, or the run is reported as
+incoherent and the exit status is 1.
+
+Run it on a machine with cores to spare: the clients compete with the
+workers for CPU, so with fewer cores than workers plus clients the
+speedup flattens early.
+"""
+import argparse
+import http.client
+import multiprocessing
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+URLS = [
+    "/books", "/books?page=2", "/members", "/borrow", "/reports/overdue",
+    "/api/v1/books", "/api/v1/books?category=Fiction", "/api/v1/reports/available",
+    "/api/v1/lookup/books?q=the",
+]
+
+# Requests each client sends on one connection before opening another
+PER_CONNECTION = 20
+
+
+def client(port, seconds, seed, results):
+    """Send requests until ``seconds`` are up; report count, errors and
+    latencies."""
+    rng = random.Random(seed)
+    deadline = time.perf_counter() + seconds
+    count = errors = 0
+    latencies = []
+    conn = None
+    while time.perf_counter() < deadline:
+        if count % PER_CONNECTION == 0:
+            if conn is not None:
+                conn.close()
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        start = time.perf_counter()
+        try:
+            conn.request("GET", rng.choice(URLS))
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                errors += 1
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        latencies.append(time.perf_counter() - start)
+        count += 1
+    conn.close()
+    results.put((count, errors, latencies))
+
+
+def start_server(workers, port, env):
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py",
+         "--workers", str(workers), "--bind", f"127.0.0.1:{port}"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    # Ready once every worker has loaded its tables and answers
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            conn.request("GET", "/api/v1/books")
+            if conn.getresponse().status == 200:
+                time.sleep(workers * 0.5)
+                return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError("gunicorn did not start")
+
+
+def writer(app, stop, rate, done):
+    """Edit a random book ``rate`` times a second through this process."""
+    books = app.config["BOOKS"]
+    rng = random.Random(0)
+    last = books.ids.last
+    while not stop.wait(1 / rate):
+        book = books.get(rng.randint(1, last))
+        if book is None:
+            continue
+        with app.app_context(), app.config["TRANSACTION"]():
+            books.update(book, description=f"Edited {time.time():.3f}")
+        done[0] += 1
+
+
+def coherent(app, port, probes=40):
+    """Add a member here and check that every worker returns it."""
+    members = app.config["MEMBERS"]
+    from models import Member
+    with app.app_context(), app.config["TRANSACTION"]():
+        member = members.add(Member(members.ids.next(), "Coherence Check", "check@example.com", "0000000000"))
+    for _ in range(probes):
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+        conn.request("GET", f"/api/v1/members/{member.id}")
+        status = conn.getresponse().status
+        conn.close()
+        if status != 200:
+            return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", default=",".join(
+        str(n) for n in (1, 2, 4, 8, 16) if n <= os.cpu_count()
+    ) or "1")
+    parser.add_argument("--clients", type=int, default=max(os.cpu_count(), 2))
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--writes-per-second", type=float, default=0)
+    parser.add_argument("--books", type=int, default=5_000)
+    parser.add_argument("--members", type=int, default=1_000)
+    parser.add_argument("--loans", type=int, default=20_000)
+    parser.add_argument("--port", type=int, default=5077)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_workers")
+    env = dict(
+        os.environ, DATABASE_URL=f"sqlite:///{workdir}/library.db", SHARED_STORAGE="1",
+        OVERDUE_SCHEDULER="0", LOG_LEVEL="WARNING", METRICS=""
+    )
+    # This process joins in as one more worker: it seeds the database,
+    # and later writes and checks coherence through the same change log
+    os.environ.update(env)
+    from main import app
+    from datagen import seed_app
+    start = time.perf_counter()
+    seed_app(app, books=args.books, members=args.members, loans=args.loans)
+    print(f"seeded {args.books:,} books, {args.members:,} members, {args.loans:,} loans "
+          f"in {time.perf_counter() - start:.1f}s; {args.clients} clients, {os.cpu_count()} cores\n")
+
+    print(f"{'workers':>7} {'req/s':>9} {'speedup':>8} {'p50 ms':>8} {'p99 ms':>8} "
+          f"{'errors':>7} {'writes':>7} {'coherent':>9}")
+    base = None
+    failed = False
+    try:
+        for workers in [int(n) for n in args.workers.split(",")]:
+            server = start_server(workers, args.port, env)
+            try:
+                stop = threading.Event()
+                done = [0]
+                if args.writes_per_second:
+                    threading.Thread(
+                        target=writer, args=(app, stop, args.writes_per_second, done), daemon=True
+                    ).start()
+                results = multiprocessing.Queue()
+                clients = [
+                    multiprocessing.Process(target=client, args=(args.port, args.seconds, i, results))
+                    for i in range(args.clients)
+                ]
+                for process in clients:
+                    process.start()
+                outcomes = [results.get() for _ in clients]
+                for process in clients:
+                    process.join()
+                stop.set()
+                ok = coherent(app, args.port)
+            finally:
+                server.terminate()
+                server.wait()
+            count = sum(c for c, _, _ in outcomes)
+            errors = sum(e for _, e, _ in outcomes)
+            latencies = sorted(lat for _, _, lats in outcomes for lat in lats)
+            rate = count / args.seconds
+            base = base or rate
+            p99 = latencies[int(len(latencies) * 0.99)]
+            print(f"{workers:7} {rate:9.0f} {rate / base:7.2f}x {statistics.median(latencies) * 1000:8.1f} "
+                  f"{p99 * 1000:8.1f} {errors:7} {done[0]:7} {'yes' if ok else 'NO':>9}")
+            failed = failed or not ok or errors > 0
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+"""Synthetic library data for the benchmarks.
+
+Generates books, members and a borrowing history of any size from a
+seed, so two runs with the same arguments see identical data:
+
+* book popularity is skewed: a few titles account for most past loans;
+* most titles have one copy, one in five has two to five;
+* ``active`` of the books have a copy on loan right now, and ``overdue``
+  of those loans are past due. Most overdue loans are only a few days
+  late, with a long tail;
+* returned loans are spread over the last two years.
+
+``seed_app`` loads the data into the app's tables in batches through
+``Table.add_many``, which keeps every index up to date, and keeps each
+title's copy counters in step with its copies.
+"""
+import random
+from datetime import date, timedelta
+from itertools import islice
+
+from models import Book, Member, Borrowing, Copy, BORROWED, OVERDUE
+from inventory import barcode_for, title_status
+
+WORDS = (
+    "python flask web data science history art garden music ocean river "
+    "mountain kitchen travel design network security cloud poetry war peace "
+    "night day light shadow stone glass iron silver golden hidden lost"
+).split()
+FIRST = "alice bob carol dave erin frank grace heidi ivan judy mallory oscar peggy trent".split()
+LAST = "smith doe johnson brown garcia miller davis wilson moore taylor".split()
+CATEGORIES = [
+    "Programming", "Web Development", "Science", "History", "Art", "Fiction",
+    "Poetry", "Travel", "Cooking", "Music", "Design", "Security"
+]
+
+BATCH = 10_000
+
+
+def make_books(ids, lent, rng):
+    for id in ids:
+        copies = 1 if rng.random() < 0.8 else rng.randint(2, 5)
+        available = copies - (id in lent)
+        yield Book(
+            id=id,
+            title=" ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 5))).title(),
+            author=f"{rng.choice(FIRST).title()} {rng.choice(LAST).title()}",
+            isbn=f"978-{id:010d}",
+            # Skewed so some categories are much bigger than others
+            category=CATEGORIES[min(int(rng.expovariate(0.35)), len(CATEGORIES) - 1)],
+            published_year=rng.randint(1950, 2024),
+            status=title_status(available),
+            description="",
+            total_copies=copies,
+            available_copies=available,
+        )
+
+
+def make_copies(books, ids, lent, first_copy):
+    """Copies of ``books``; the first copy of each lent title is out."""
+    ids = iter(ids)
+    for book in books:
+        for n in range(book.total_copies):
+            id = next(ids)
+            out = n == 0 and book.id in lent
+            if out:
+                first_copy[book.id] = id
+            yield Copy(id, book.id, barcode_for(id), BORROWED if out else "Available")
+
+
+def make_members(ids, rng, today):
+    for id in ids:
+        first, last = rng.choice(FIRST), rng.choice(LAST)
+        yield Member(
+            id=id,
+            name=f"{first.title()} {last.title()}",
+            email=f"{first}.{last}.{id}@example.org",
+            phone=f"555-{id:07d}",
+            join_date=today - timedelta(days=rng.randint(0, 3650)),
+            membership_status="Active" if rng.random() < 0.95 else "Inactive",
+        )
+
+
+def make_loans(ids, book_ids, member_ids, lent, overdue, rng, today, first_copy=None):
+    """Active loans for the books in ``lent`` first, then returned ones."""
+    ids = iter(ids)
+    first_copy = first_copy or {}
+    for book_id in lent:
+        borrowed = today - timedelta(days=rng.randint(1, 60))
+        if rng.random() < overdue:
+            due = today - timedelta(days=1 + int(rng.expovariate(0.1)))
+            borrowed = min(borrowed, due - timedelta(days=14))
+        else:
+            due = today + timedelta(days=rng.randint(0, 14))
+            borrowed = min(borrowed, due)
+        yield Borrowing(
+            id=next(ids), book_id=book_id, member_id=rng.choice(member_ids),
+            borrow_date=borrowed, due_date=due,
+            status=OVERDUE if due < today else BORROWED,
+            copy_id=first_copy.get(book_id),
+        )
+    for id in ids:
+        # Popular books (low offsets) are borrowed far more often
+        book_id = book_ids[int(len(book_ids) * rng.random() ** 3)]
+        borrowed = today - timedelta(days=rng.randint(15, 730))
+        yield Borrowing(
+            id=id, book_id=book_id, member_id=rng.choice(member_ids),
+            borrow_date=borrowed, due_date=borrowed + timedelta(days=14),
+            return_date=borrowed + timedelta(days=rng.randint(1, 20)),
+            status="Returned",
+        )
+
+
+def seed_app(app, books=1000, members=200, loans=5000, active=0.1, overdue=0.2, seed=1):
+    """Add synthetic records to ``app``'s tables; return the new ids."""
+    rng = random.Random(seed)
+    today = date.today()
+    tables = app.config["BOOKS"], app.config["MEMBERS"], app.config["BORROWINGS"]
+    book_ids = tables[0].ids.reserve(books)
+    member_ids = tables[1].ids.reserve(members)
+    loans = max(loans, int(books * active))
+    loan_ids = tables[2].ids.reserve(loans)
+    lent = set(rng.sample(book_ids, int(books * active)))
+
+    copies = app.config["COPIES"]
+    first_copy = {}
+    titles = make_books(book_ids, lent, rng)
+    while True:
+        batch = list(islice(titles, BATCH))
+        if not batch:
+            break
+        copy_ids = copies.ids.reserve(sum(book.total_copies for book in batch))
+        with app.config["TRANSACTION"]():
+            tables[0].add_many(batch)
+            copies.add_many(list(make_copies(batch, copy_ids, lent, first_copy)))
+
+    for table, records in zip(tables[1:], (
+        make_members(member_ids, rng, today),
+        make_loans(loan_ids, book_ids, member_ids, lent, overdue, rng, today, first_copy),
+    )):
+        while True:
+            batch = list(islice(records, BATCH))
+            if not batch:
+                break
+            with app.config["TRANSACTION"]():
+                table.add_many(batch)
+    return {"books": book_ids, "members": member_ids, "borrowings": loan_ids}
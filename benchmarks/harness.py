@@ -0,0 +1,362 @@
+"""Drive every route against synthetic data and record how it performs.
+
+Usage:
+    python benchmarks/harness.py --preset 100k --out results.json
+    python benchmarks/harness.py --preset 100k --compare results.json
+
+Seeds the app with ``datagen.seed_app`` (``--books``, ``--members``,
+``--loans``, ``--active`` and ``--overdue`` override the preset), then
+sends ``--requests`` requests to each case below through Flask's test
+client: every page, form, report, export and API route, GET and POST.
+Reads run before writes, and writes use their own client, so flash
+messages from the writes never reach the read pages.
+
+Results are JSON: per case the request count, errors, throughput and
+mean/p50/p95/p99/max latency in milliseconds, plus seeding time and peak
+RSS for the whole run. With ``--compare`` the new results are printed
+next to an earlier file. The exit status is 1 if any case's p50 and p95
+both got worse by more than ``--threshold``.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import app  # noqa: E402
+from datagen import WORDS, CATEGORIES, seed_app  # noqa: E402
+
+# (books, members, loans) per preset
+PRESETS = {
+    "1k": (1_000, 200, 5_000),
+    "10k": (10_000, 2_000, 50_000),
+    "100k": (100_000, 20_000, 500_000),
+    "1m": (1_000_000, 200_000, 5_000_000),
+    "10m": (10_000_000, 2_000_000, 10_000_000),
+}
+
+
+class Context:
+    """What the cases need to build their requests."""
+
+    def __init__(self, ids, seed):
+        self.rng = random.Random(seed)
+        self.ids = ids
+        self.books = app.config["BOOKS"]
+        self.members = app.config["MEMBERS"]
+        self.borrowings = app.config["BORROWINGS"]
+        self.added_books = []
+        self.added_members = []
+        self.etag = None
+
+    def book(self):
+        return self.rng.choice(self.ids["books"])
+
+    def member(self):
+        return self.rng.choice(self.ids["members"])
+
+    def loan(self):
+        return self.rng.choice(self.ids["borrowings"])
+
+    def available_book(self):
+        for _ in range(100):
+            book = self.books.get(self.book())
+            if book is not None and book.status == "Available":
+                return book.id
+        return next(iter(self.books.indexes["status"].ids("Available")))
+
+    def active_loan(self):
+        status = self.borrowings.indexes["status"]
+        return next(iter(status.ids("Borrowed") or status.ids("Overdue")))
+
+    def word(self):
+        return self.rng.choice(WORDS)
+
+    def category(self):
+        return self.rng.choice(CATEGORIES)
+
+
+def book_form(ctx):
+    n = ctx.rng.randrange(10**9)
+    return {
+        "title": f"Bench {ctx.word()} {n}", "author": "Bench Author",
+        "isbn": f"999-{n:010d}", "category": ctx.category(),
+        "published_year": 2001, "description": "", "total_copies": 2,
+    }
+
+
+def member_form(ctx):
+    n = ctx.rng.randrange(10**9)
+    return {
+        "name": f"Bench Member {n}", "email": f"bench{n}@example.org",
+        "phone": f"555-{n:010d}", "membership_status": "Active",
+    }
+
+
+def add_book(ctx):
+    ctx.added_books.append(ctx.books.ids.last + 1)
+    return book_form(ctx)
+
+
+def add_member(ctx):
+    ctx.added_members.append(ctx.members.ids.last + 1)
+    return member_form(ctx)
+
+
+def borrow_form(ctx):
+    today = date.today()
+    return {
+        "book_id": ctx.available_book(), "member_id": ctx.member(),
+        "borrow_date": today.isoformat(),
+        "due_date": (today + timedelta(days=14)).isoformat(),
+    }
+
+
+def import_file(ctx):
+    rows = ["title,author,isbn,category,published_year"] + [
+        f"Imported {ctx.word()},Bench Author,998-{ctx.rng.randrange(10**10):010d},{ctx.category()},1999"
+        for _ in range(100)
+    ]
+    return {"kind": "books", "file": (io.BytesIO("\n".join(rows).encode()), "books.csv")}
+
+
+def conditional_headers(ctx):
+    return {"If-None-Match": ctx.etag} if ctx.etag else {}
+
+
+# name -> (method, url(ctx), form data(ctx) or None, share of --requests)
+READS = {
+    "index": ("GET", lambda c: "/", None, 1),
+    "books_index": ("GET", lambda c: f"/books?after={c.book()}", None, 1),
+    "books_search": ("GET", lambda c: f"/books?query={c.word()}", None, 1),
+    "books_filter": ("GET", lambda c: f"/books?category={c.category()}&status=Available", None, 1),
+    "books_view": ("GET", lambda c: f"/books/{c.book()}", None, 1),
+    "books_add_form": ("GET", lambda c: "/books/add", None, 1),
+    "books_edit_form": ("GET", lambda c: f"/books/edit/{c.book()}", None, 1),
+    "members_index": ("GET", lambda c: f"/members?after={c.member()}", None, 1),
+    "members_search": ("GET", lambda c: f"/members?query={c.rng.choice(['smith', 'ali', '555-0'])}", None, 1),
+    "members_view": ("GET", lambda c: f"/members/{c.member()}", None, 1),
+    "members_add_form": ("GET", lambda c: "/members/add", None, 1),
+    "members_edit_form": ("GET", lambda c: f"/members/edit/{c.member()}", None, 1),
+    "borrow_index": ("GET", lambda c: "/borrow", None, 1),
+    "borrow_index_stream": ("GET", lambda c: "/borrow?stream=1", None, 0.02),
+    "borrow_add_form": ("GET", lambda c: "/borrow/add", None, 0.1),
+    "borrow_return_form": ("GET", lambda c: f"/borrow/return/{c.active_loan()}", None, 1),
+    "holds_index": ("GET", lambda c: "/holds", None, 1),
+    "holds_waiting": ("GET", lambda c: "/holds?status=Waiting", None, 1),
+    "reports_overdue": ("GET", lambda c: "/reports/overdue", None, 1),
+    "reports_available": ("GET", lambda c: f"/reports/available?category={c.category()}", None, 1),
+    "import_form": ("GET", lambda c: "/import", None, 1),
+    "export_books_csv": ("GET", lambda c: "/export/books.csv", None, 0.02),
+    "export_loans_jsonl": ("GET", lambda c: "/export/borrowings.jsonl", None, 0.02),
+    "cache_stats": ("GET", lambda c: "/cache/stats", None, 1),
+    "api_books": ("GET", lambda c: f"/api/v1/books?after={c.book()}&fields=id,title", None, 1),
+    "api_books_304": ("GET", lambda c: "/api/v1/books", None, 1),
+    "api_book": ("GET", lambda c: f"/api/v1/books/{c.book()}", None, 1),
+    "api_members": ("GET", lambda c: "/api/v1/members", None, 1),
+    "api_member": ("GET", lambda c: f"/api/v1/members/{c.member()}", None, 1),
+    "api_borrowings": ("GET", lambda c: "/api/v1/borrowings", None, 1),
+    "api_borrowing": ("GET", lambda c: f"/api/v1/borrowings/{c.loan()}", None, 1),
+    "api_lookup_books": ("GET", lambda c: f"/api/v1/lookup/books?q={c.word()[:3]}&status=Available", None, 1),
+    "api_lookup_members": ("GET", lambda c: f"/api/v1/lookup/members?q={c.rng.choice(['a', 'jo', 'mar'])}", None, 1),
+    "api_reports_overdue": ("GET", lambda c: "/api/v1/reports/overdue", None, 1),
+    "api_reports_available": ("GET", lambda c: f"/api/v1/reports/available?category={c.category()}", None, 1),
+}
+WRITES = {
+    "books_add": ("POST", lambda c: "/books/add", add_book, 1),
+    "books_edit": ("POST", lambda c: f"/books/edit/{c.available_book()}", book_form, 1),
+    "books_delete": ("POST", lambda c: f"/books/delete/{c.added_books.pop()}", None, 1),
+    "members_add": ("POST", lambda c: "/members/add", add_member, 1),
+    "members_edit": ("POST", lambda c: f"/members/edit/{c.member()}", member_form, 1),
+    "members_delete": ("POST", lambda c: f"/members/delete/{c.added_members.pop()}", None, 1),
+    "borrow_add": ("POST", lambda c: "/borrow/add", borrow_form, 1),
+    "borrow_return": ("POST", lambda c: f"/borrow/return/{c.active_loan()}",
+                      lambda c: {"return_date": date.today().isoformat()}, 1),
+    "import_books": ("POST", lambda c: "/import", import_file, 0.1),
+}
+
+
+def rss_mb():
+    """Current resident set size, from /proc where available."""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+
+
+def run_case(client, ctx, name, case, requests):
+    method, url, data, share = case
+    count = max(1, int(requests * share))
+    latencies = []
+    errors = 0
+    wall = time.perf_counter()
+    for _ in range(count):
+        path = url(ctx)
+        kwargs = {"headers": {"Accept": "application/json"}} if name == "import_books" else {}
+        if data is not None:
+            kwargs["data"] = data(ctx)
+        if name == "api_books_304":
+            kwargs["headers"] = conditional_headers(ctx)
+        start = time.perf_counter()
+        response = client.open(path, method=method, **kwargs)
+        body = response.get_data()
+        latencies.append(time.perf_counter() - start)
+        if name == "api_books_304":
+            ctx.etag = response.headers.get("ETag")
+        if response.status_code not in (200, 302, 304):
+            errors += 1
+        response.close()
+        del body
+    wall = time.perf_counter() - wall
+    latencies.sort()
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive") if count > 1 else latencies * 99
+    return {
+        "requests": count,
+        "errors": errors,
+        "rps": count / wall,
+        "mean_ms": statistics.fmean(latencies) * 1e3,
+        "p50_ms": cuts[49] * 1e3,
+        "p95_ms": cuts[94] * 1e3,
+        "p99_ms": cuts[98] * 1e3,
+        "max_ms": latencies[-1] * 1e3,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Print results next to ``baseline``; return the regressed case names."""
+    regressed = []
+    print(f"\n{'case':<24}{'p50 ms':>18}{'p95 ms':>20}{'rps':>20}")
+    for name, new in results["cases"].items():
+        old = baseline["cases"].get(name)
+        if old is None:
+            print(f"{name:<24}{'(new case)':>18}")
+            continue
+        change = new["p95_ms"] / old["p95_ms"] - 1 if old["p95_ms"] else 0.0
+        # Both the median and the tail must be slower, which filters out
+        # most one-off noise; sub-0.1 ms jitter on the fastest routes is
+        # ignored
+        worse = all(
+            new[key] > old[key] * (1 + threshold) and new[key] - old[key] > 0.1
+            for key in ("p50_ms", "p95_ms")
+        )
+        if worse:
+            regressed.append(name)
+        print(
+            f"{name:<24}{old['p50_ms']:>8.2f} ->{new['p50_ms']:>7.2f}"
+            f"{old['p95_ms']:>9.2f} ->{new['p95_ms']:>7.2f}{change:>+7.0%}"
+            f"{old['rps']:>10.0f} ->{new['rps']:>8.0f}"
+            + ("  REGRESSED" if worse else "")
+        )
+    print(f"peak RSS {baseline['peak_rss_mb']:.0f} MB -> {results['peak_rss_mb']:.0f} MB")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--preset", choices=PRESETS, default="10k")
+    parser.add_argument("--books", type=int)
+    parser.add_argument("--members", type=int)
+    parser.add_argument("--loans", type=int)
+    parser.add_argument("--active", type=float, default=0.1, help="share of books on loan")
+    parser.add_argument("--overdue", type=float, default=0.2, help="share of loans past due")
+    parser.add_argument("--requests", type=int, default=200, help="requests per case")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--no-cache", action="store_true", help="disable the page cache")
+    parser.add_argument("--only", help="comma-separated case names to run")
+    parser.add_argument("--out", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="earlier results file to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown")
+    args = parser.parse_args()
+
+    books, members, loans = PRESETS[args.preset]
+    books = args.books or books
+    members = args.members or members
+    loans = args.loans or loans
+
+    app.config["WTF_CSRF_ENABLED"] = False
+    if args.no_cache:
+        app.config["PAGE_CACHE"] = None
+
+    start = time.perf_counter()
+    ids = seed_app(app, books, members, loans, args.active, args.overdue, args.seed)
+    seed_seconds = time.perf_counter() - start
+    seeded_rss = rss_mb()
+    print(f"seeded {books:,} books, {members:,} members, {loans:,} loans "
+          f"in {seed_seconds:.1f}s (RSS {seeded_rss:.0f} MB)", file=sys.stderr)
+
+    ctx = Context(ids, args.seed)
+    only = set(args.only.split(",")) if args.only else None
+    cases = {}
+    for client, group in ((app.test_client(), READS), (app.test_client(), WRITES)):
+        for name, case in group.items():
+            if only and name not in only:
+                continue
+            cases[name] = result = run_case(client, ctx, name, case, args.requests)
+            print(f"{name:<24}{result['p50_ms']:>9.2f} ms p50{result['p95_ms']:>9.2f} ms p95"
+                  f"{result['rps']:>10.0f} req/s"
+                  + (f"  {result['errors']} errors" if result["errors"] else ""),
+                  file=sys.stderr)
+
+    results = {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "date": date.today().isoformat(),
+            "books": books, "members": members, "loans": loans,
+            "active": args.active, "overdue": args.overdue,
+            "requests": args.requests, "seed": args.seed,
+            "page_cache": not args.no_cache,
+            "database_url": os.environ.get("DATABASE_URL", "memory://"),
+        },
+        "seed_seconds": seed_seconds,
+        "seeded_rss_mb": seeded_rss,
+        "peak_rss_mb": peak_rss_mb(),
+        "cases": cases,
+    }
+    if args.out:
+        with open(args.out, "w") as out:
+            json.dump(results, out, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            regressed = compare(results, json.load(baseline), args.threshold)
+        if regressed:
+            print(f"{len(regressed)} case(s) regressed: {', '.join(regressed)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,221 @@
+"""Hammer borrow and return from many threads and check the invariants.
+
+Usage: python benchmarks/stress_borrow.py [--threads 16] [--seconds 10]
+
+Writer threads POST random borrows, returns and holds (place, collect,
+cancel) while reader threads keep loading the listing and report pages.
+Afterwards the script checks that:
+
+* no copy was ever lent twice at once, each copy's status matches
+  whether it is on loan or set aside for a hold, and each title's copy
+  counters and status match its copies;
+* each copy set aside belongs to exactly one Ready hold, each title's
+  hold queue is its Waiting holds in the order placed, and no hold is
+  waiting for a title with a copy on the shelf;
+* every index agrees with a full scan of its table;
+* borrowing ids are unique;
+* no request failed.
+
+Exits non-zero if any check fails.
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import app  # noqa: E402
+from inventory import new_copies  # noqa: E402
+from models import Book, Member, ON_LOAN  # noqa: E402
+
+READ_URLS = [
+    "/", "/books", "/borrow", "/reports/overdue", "/reports/available", "/members",
+    "/holds", "/holds?status=Waiting"
+]
+
+
+def writer(stop, errors, seed):
+    rng = random.Random(seed)
+    client = app.test_client()
+    books = app.config["BOOKS"]
+    borrowings = app.config["BORROWINGS"]
+    holds = app.config["HOLDS"]
+    members = app.config["MEMBERS"]
+    today = date.today()
+    while not stop.is_set():
+        action = rng.random()
+        if action < 0.15:
+            response = client.post("/holds/add", data={
+                "book_id": rng.randint(1, books.ids.last),
+                "member_id": rng.randint(1, members.ids.last),
+            })
+        elif action < 0.25:
+            ready = holds.lookup("status", "Ready")
+            if not ready:
+                continue
+            response = client.post(f"/holds/{rng.choice(ready).id}/collect")
+        elif action < 0.3:
+            open_holds = holds.lookup("status", "Waiting") + holds.lookup("status", "Ready")
+            if not open_holds:
+                continue
+            response = client.post(f"/holds/{rng.choice(open_holds).id}/cancel")
+        elif action < 0.65:
+            book_id = rng.randint(1, books.ids.last)
+            due = today + timedelta(days=rng.randint(-30, 30))
+            response = client.post("/borrow/add", data={
+                "book_id": book_id,
+                "member_id": 1,
+                "borrow_date": (due - timedelta(days=14)).isoformat(),
+                "due_date": due.isoformat(),
+            })
+        else:
+            active = borrowings.lookup("status", "Borrowed") + borrowings.lookup("status", "Overdue")
+            if not active:
+                continue
+            loan = rng.choice(active)
+            response = client.post(f"/borrow/return/{loan.id}", data={
+                "borrowing_id": loan.id,
+                "return_date": today.isoformat(),
+            })
+        if response.status_code not in (200, 302):
+            errors.append(f"write: HTTP {response.status_code}")
+
+
+def reader(stop, errors, seed):
+    rng = random.Random(seed)
+    client = app.test_client()
+    while not stop.is_set():
+        url = rng.choice(READ_URLS)
+        response = client.get(url)
+        if response.status_code != 200:
+            errors.append(f"read {url}: HTTP {response.status_code}")
+
+
+def check_invariants():
+    books = app.config["BOOKS"]
+    borrowings = app.config["BORROWINGS"]
+    problems = []
+
+    copies = app.config["COPIES"]
+    loans = [b for b in borrowings if b.status in ON_LOAN]
+    lent = Counter(b.copy_id for b in loans)
+    for copy_id, count in lent.items():
+        if count > 1:
+            problems.append(f"copy {copy_id} has {count} active loans")
+    for copy in copies:
+        if (copy.status == "Borrowed") != (lent[copy.id] > 0):
+            problems.append(f"copy {copy.id} status {copy.status} but {lent[copy.id]} active loans")
+    holds = app.config["HOLDS"]
+    ready = Counter(hold.copy_id for hold in holds if hold.status == "Ready")
+    for copy in copies:
+        if (copy.status == "On Hold") != (ready[copy.id] == 1) or ready[copy.id] > 1:
+            problems.append(f"copy {copy.id} status {copy.status} but {ready[copy.id]} ready holds")
+    active = Counter(b.book_id for b in loans)
+    set_aside = Counter(copy.book_id for copy in copies if copy.status == "On Hold")
+    held = Counter(copy.book_id for copy in copies)
+    queue = holds.indexes["queue"]
+    for book in books:
+        on_shelf = held[book.id] - active[book.id] - set_aside[book.id]
+        if book.total_copies != held[book.id] or book.available_copies != on_shelf:
+            problems.append(
+                f"book {book.id} counts {book.available_copies}/{book.total_copies} "
+                f"but {on_shelf}/{held[book.id]} copies"
+            )
+        if (book.status == "Available") != (book.available_copies > 0):
+            problems.append(f"book {book.id} status {book.status} with {book.available_copies} available")
+        waiting = sorted(
+            (hold for hold in holds.lookup("book_id", book.id) if hold.status == "Waiting"),
+            key=lambda hold: hold.id
+        )
+        if (queue.waiting(book.id) != len(waiting)
+                or [queue.position(hold) for hold in waiting] != list(range(1, len(waiting) + 1))):
+            problems.append(f"book {book.id} queue does not match its waiting holds")
+        if waiting and book.available_copies:
+            problems.append(f"book {book.id} has {len(waiting)} holds waiting and a copy on the shelf")
+
+    for table in (books, copies, borrowings, holds):
+        for field, index in table.indexes.items():
+            if index.fields == (field,) and hasattr(index, "count"):
+                for value, count in Counter(getattr(r, field) for r in table).items():
+                    if index.count(value) != count:
+                        problems.append(f"{table.name}.{field}={value!r}: index {index.count(value)} != {count}")
+
+    due = borrowings.indexes["due_date"]
+    if len(due) != borrowings.count("status", "Borrowed"):
+        problems.append(f"due_date index has {len(due)} entries for {borrowings.count('status', 'Borrowed')} loans")
+    overdue = borrowings.count("status", "Overdue")
+    for name in ("overdue", "fines"):
+        if len(borrowings.indexes[name]) != overdue:
+            problems.append(f"{name} index has {len(borrowings.indexes[name])} entries for {overdue} loans")
+    keys = [key for key, _ in due.scan()]
+    if keys != sorted(keys):
+        problems.append("due_date index out of order")
+
+    ids = [b.id for b in borrowings]
+    if len(ids) != len(set(ids)):
+        problems.append("duplicate borrowing ids")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--books", type=int, default=20)
+    parser.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+
+    app.config["WTF_CSRF_ENABLED"] = False
+    books = app.config["BOOKS"]
+    # One to three copies each, so titles run out only after several loans
+    new = [
+        Book(id=books.ids.next(), title=f"Stress {i}", author="Load Test",
+             isbn=f"000-{i:010d}", category="Stress", published_year=2000,
+             total_copies=1 + i % 3)
+        for i in range(args.books)
+    ]
+    members = app.config["MEMBERS"]
+    with app.app_context(), app.config["TRANSACTION"]():
+        copies = new_copies(new)
+        books.add_many(new)
+        app.config["COPIES"].add_many(copies)
+        # Members to place holds
+        members.add_many([
+            Member(members.ids.next(), f"Stress {i}", f"stress{i}@example.com", "0000000000")
+            for i in range(8)
+        ])
+
+    # Switch threads as often as possible to widen every race window
+    sys.setswitchinterval(1e-6)
+    stop = threading.Event()
+    errors = []
+    threads = [
+        threading.Thread(target=writer, args=(stop, errors, i)) for i in range(args.threads)
+    ] + [
+        threading.Thread(target=reader, args=(stop, errors, -i)) for i in range(args.readers)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    problems = errors[:20] + check_invariants()
+    borrowings = app.config["BORROWINGS"]
+    print(f"{len(borrowings)} borrowings recorded by {args.threads} writer threads")
+    statuses = Counter(hold.status for hold in app.config["HOLDS"])
+    print("holds:", ", ".join(f"{count} {status}" for status, count in sorted(statuses.items())))
+    for problem in problems:
+        print("FAIL:", problem)
+    print("OK" if not problems else f"{len(problems)} problem(s)")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
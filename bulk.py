@@ -0,0 +1,227 @@
+"""Bulk import and export of books, members and borrowings.
+
+Imports read the uploaded file one row at a time (CSV with a header row,
+or JSON Lines) and validate each row with the same form the add page
+uses. Valid rows are committed in batches of ``IMPORT_BATCH``: ids for a
+batch are reserved in one block, and the batch is written to storage in
+one transaction. Invalid rows are skipped and listed in the report, by
+line number, with the same messages the forms show.
+
+Exports are generators, so the response is written as the table is
+walked and memory stays flat however many records there are.
+"""
+import csv
+import io
+import json
+from collections import Counter
+from datetime import date
+from itertools import islice
+
+from flask import current_app
+from werkzeug.datastructures import MultiDict
+
+from forms import BookForm, MemberForm, BorrowingRecordForm
+from inventory import new_copies, lend
+from models import Book, Member, Borrowing, BORROWED, OVERDUE, ON_LOAN, to_date
+
+IMPORT_BATCH = 1000
+# Rows with errors listed in a report; later ones are only counted
+MAX_REPORTED_ERRORS = 1000
+# Records serialised per chunk of an export response
+EXPORT_CHUNK = 500
+
+# Record kind -> (model, row form, app.config key of its table)
+KINDS = {
+    "books": (Book, BookForm, "BOOKS"),
+    "members": (Member, MemberForm, "MEMBERS"),
+    "borrowings": (Borrowing, BorrowingRecordForm, "BORROWINGS"),
+}
+
+# Ids are stored as 64-bit integers (INTEGER in SQLite, BIGINT in Postgres)
+MAX_ID = 2 ** 63 - 1
+
+# Fields a row may leave out
+DEFAULTS = {
+    "books": {"description": "", "total_copies": "1"},
+    "members": {"membership_status": "Active"},
+    "borrowings": {"status": "Borrowed"},
+}
+
+
+def read_rows(upload):
+    """Yield ``(line number, row)`` from an uploaded CSV or JSON Lines file.
+
+    A row that cannot be read is yielded as the message saying why: a
+    JSON line that does not hold an object, or text that is not UTF-8.
+    Reading stops at the first text that cannot be decoded.
+    """
+    text = io.TextIOWrapper(upload.stream, encoding="utf-8-sig", newline="")
+    number = 0
+    try:
+        if upload.filename.lower().endswith(".jsonl"):
+            for number, line in enumerate(text, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = None
+                yield number, row if isinstance(row, dict) else "Not a JSON object"
+        else:
+            reader = csv.DictReader(text)
+            for row in reader:
+                number = reader.line_num
+                yield number, row
+    except UnicodeDecodeError:
+        # Decoded a block at a time, so the bad byte is at or after here
+        yield number + 1, "Not UTF-8 text; save the file as UTF-8 and import the rest again"
+
+
+def import_rows(kind, rows):
+    """Validate and store ``rows`` of ``kind``; return the error report."""
+    _, form_class, key = KINDS[kind]
+    table = current_app.config[key]
+    # One form, re-filled for every row
+    form = form_class(formdata=None, meta={"csrf": False})
+    report = {"kind": kind, "imported": 0, "failed": 0, "errors": []}
+
+    def fail(number, errors):
+        report["failed"] += 1
+        if len(report["errors"]) < MAX_REPORTED_ERRORS:
+            report["errors"].append({"row": number, "errors": errors})
+
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, IMPORT_BATCH))
+        if not batch:
+            break
+        valid = []
+        for number, row in batch:
+            if not isinstance(row, dict):
+                fail(number, {"row": [row]})
+                continue
+            values, errors = _validate(kind, form, row)
+            if errors:
+                fail(number, errors)
+            else:
+                valid.append((number, values))
+        with current_app.config["TRANSACTION"]():
+            records = _link(kind, table, valid, fail)
+            if kind == "books":
+                copies = new_copies(records)
+                table.add_many(records)
+                current_app.config["COPIES"].add_many(copies)
+            else:
+                if kind == "borrowings":
+                    # Loans still out take a copy off the shelf
+                    books = current_app.config["BOOKS"]
+                    for record in records:
+                        if record.status in ON_LOAN:
+                            record.copy_id = lend(books.get(record.book_id)).id
+                table.add_many(records)
+        report["imported"] += len(records)
+    report["truncated"] = report["failed"] > len(report["errors"])
+    return report
+
+
+def _validate(kind, form, row):
+    """Check one row with ``form``; return ``(field values, errors)``."""
+    row = {**DEFAULTS[kind], **{
+        name: str(value).strip()
+        for name, value in row.items()
+        if name and value not in (None, "")
+    }}
+    form.process(MultiDict(row))
+    errors = {} if form.validate() else dict(form.errors)
+    values = {name: field.data for name, field in form._fields.items()}
+    if row.get("id"):
+        try:
+            values["id"] = int(row["id"])
+        except ValueError:
+            errors["id"] = ["Not a valid integer value."]
+        else:
+            if not 1 <= values["id"] <= MAX_ID:
+                errors["id"] = [f"Id must be between 1 and {MAX_ID}."]
+    if kind == "members" and row.get("join_date"):
+        try:
+            values["join_date"] = to_date(row["join_date"])
+        except ValueError:
+            errors["join_date"] = ["Not a valid date value."]
+    return values, errors
+
+
+def _link(kind, table, valid, fail):
+    """Build the batch's records, checking ids and references.
+
+    Runs under the write lock, so the checks see a stable table.
+    """
+    model = KINDS[kind][0]
+    taken = set()
+    lent = Counter()
+    books = current_app.config["BOOKS"]
+    members = current_app.config["MEMBERS"]
+    today = date.today()
+    checked = []
+    for number, values in valid:
+        id = values.get("id")
+        if id is not None and (id in table or id in taken):
+            fail(number, {"id": [f"Id {id} is already in use."]})
+            continue
+        if kind == "borrowings":
+            errors = {}
+            book = books.get(values["book_id"])
+            if book is None:
+                errors["book_id"] = [f"No book with id {values['book_id']}."]
+            elif values["status"] in ON_LOAN and book.available_copies <= lent[book.id]:
+                errors["book_id"] = [f"Book {book.id} has no copy available."]
+            if values["member_id"] not in members:
+                errors["member_id"] = [f"No member with id {values['member_id']}."]
+            if values["due_date"] < values["borrow_date"]:
+                errors["due_date"] = ["Due date is before the borrow date."]
+            if errors:
+                fail(number, errors)
+                continue
+            if values["status"] in ON_LOAN:
+                lent[book.id] += 1
+                # Whether a loan is overdue follows from its due date
+                values["status"] = OVERDUE if values["due_date"] < today else BORROWED
+        if id is not None:
+            taken.add(id)
+        checked.append(values)
+
+    # Explicit ids move the sequence past them, then the rest get one block
+    if taken:
+        table.ids.advance(max(taken))
+    fresh = iter(table.ids.reserve(sum(1 for values in checked if values.get("id") is None)))
+    records = []
+    for values in checked:
+        if values.get("id") is None:
+            values["id"] = next(fresh)
+        records.append(model(**{
+            name: values[name] for name in model.fields if name in values
+        }))
+    return records
+
+
+def export_rows(kind, format):
+    """Yield the records of ``kind`` as CSV or JSON Lines text chunks."""
+    model, _, key = KINDS[kind]
+    table = current_app.config[key]
+    names = list(model.fields)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if format == "csv":
+        writer.writerow(names)
+    for count, record in enumerate(table, 1):
+        if format == "csv":
+            # Dates print as YYYY-MM-DD, the format the import reads back
+            writer.writerow(["" if value is None else value for value in (
+                getattr(record, name) for name in names
+            )])
+        else:
+            buffer.write(json.dumps(record.to_dict(), default=str) + "\n")
+        if count % EXPORT_CHUNK == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
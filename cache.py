@@ -0,0 +1,141 @@
+"""Bounded LRU cache for rendered pages and fragments.
+
+Each entry stores the version counters of the tables it was rendered
+from (see ``store.Table.version``). Every add, edit, delete, borrow and
+return bumps the versions of the tables it writes. A lookup whose
+versions no longer match drops the entry and renders again, so an entry
+is invalidated by exactly the writes that touch its tables, and nothing
+expires on a timer.
+
+Versions are read before rendering. If a write lands while a page is
+being rendered, the entry is stored with the older versions, so the next
+lookup sees the change and re-renders it.
+"""
+import threading
+from collections import OrderedDict
+from datetime import date
+from functools import wraps
+
+from flask import current_app, request, session
+
+from pagination import streaming
+
+
+class PageCache:
+    """LRU map from a key to rendered text, bounded by entries and bytes."""
+
+    def __init__(self, max_entries=256, max_bytes=32 * 2**20):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get_or_render(self, key, stamp, render):
+        """Return the text cached under ``key`` for ``stamp``, or render it."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] == stamp:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                self._drop(key)
+                self.invalidations += 1
+            self.misses += 1
+        text = render()
+        if isinstance(text, str):
+            self._store(key, stamp, text)
+        return text
+
+    def _store(self, key, stamp, text):
+        size = len(text)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (stamp, text)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _drop(self, key):
+        _, text = self._entries.pop(key)
+        self._bytes -= len(text)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def stamp_of(tables, daily=False):
+    """Versions of ``tables`` (app.config keys), plus today if ``daily``."""
+    stamp = tuple(current_app.config[table].version for table in tables)
+    return stamp + (date.today(),) if daily else stamp
+
+
+def cached_text(key, tables, render, daily=False):
+    """``render()``, or its text cached under ``key`` while ``tables`` are
+    unchanged; for responses that are not whole pages."""
+    cache = current_app.config.get("PAGE_CACHE")
+    if cache is None:
+        return render()
+    return cache.get_or_render(key, stamp_of(tables, daily), render)
+
+
+# key -> (stamp, choices); one entry per fixed list, so never evicted
+_choices = {}
+
+
+def cached_choices(key, tables, build):
+    """Choice data for a form from ``build()``, rebuilt only after a
+    write to ``tables``."""
+    stamp = stamp_of(tables)
+    entry = _choices.get(key)
+    if entry is None or entry[0] != stamp:
+        entry = _choices[key] = (stamp, build())
+    return entry[1]
+
+
+def cached_page(*tables, daily=False):
+    """Cache a view's rendered page, keyed by its path and query args.
+
+    ``tables`` are the app.config keys of the tables the page reads.
+    ``daily`` also re-renders at midnight, for pages that depend on
+    today's date. Requests with pending flash messages bypass the cache,
+    because the layout renders them into the page, and so do streamed
+    listings (``?stream=1``), which are never held whole.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            cache = current_app.config.get("PAGE_CACHE")
+            if cache is None or session.get("_flashes") or streaming():
+                return view(*args, **kwargs)
+            key = (request.path, tuple(sorted(request.args.items(multi=True))))
+            return cache.get_or_render(
+                key, stamp_of(tables, daily), lambda: view(*args, **kwargs)
+            )
+        return wrapper
+    return decorator
@@ -0,0 +1,95 @@
+"""Join borrowings to their books and members for the listing pages.
+
+``join_loans`` takes any stream of borrowing records (an index scan, a
+lookup result), or of holds, which carry the same two ids, and yields
+one :class:`LoanView` per record. It reads the stream in fixed-size
+batches and looks up each distinct book and member once per batch, so
+a page costs one pass over its rows and at most one batch of extra
+memory, however long the stream is.
+
+Views wrap the shared records; nothing is copied and nothing is written
+back to them.
+"""
+from datetime import date
+from itertools import islice
+
+from flask import current_app
+
+from models import RETURNED
+from scheduler import fine_for
+
+JOIN_BATCH = 64
+
+
+class LoanView:
+    """Read-only view of a borrowing with its book and member.
+
+    Borrowing fields (``id``, ``status``, ``due_date``, ...) read through
+    to the loan itself. The joined fields render as an empty string when
+    the book or member no longer exists.
+    """
+
+    __slots__ = ("loan", "book", "member")
+
+    def __init__(self, loan, book, member):
+        object.__setattr__(self, "loan", loan)
+        object.__setattr__(self, "book", book)
+        object.__setattr__(self, "member", member)
+
+    def __getattr__(self, name):
+        return getattr(self.loan, name)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    @property
+    def book_title(self):
+        return self.book.title if self.book else ""
+
+    @property
+    def book_author(self):
+        return self.book.author if self.book else ""
+
+    @property
+    def member_name(self):
+        return self.member.name if self.member else ""
+
+    @property
+    def member_email(self):
+        return self.member.email if self.member else ""
+
+    @property
+    def member_phone(self):
+        return self.member.phone if self.member else ""
+
+    @property
+    def days_overdue(self):
+        return (date.today() - self.loan.due_date).days
+
+    @property
+    def fine_owed(self):
+        """The stored fine once returned; until then, what it would be today."""
+        if self.loan.status == RETURNED:
+            return self.loan.fine
+        return fine_for(self.loan, date.today(), current_app.config["FINE_PER_DAY"])
+
+
+def join_loans(loans, books, members, complete=True, batch=JOIN_BATCH):
+    """Yield a :class:`LoanView` for each record in ``loans``.
+
+    With ``complete`` set, loans whose book or member is missing are
+    skipped, as the borrowing and report listings always have.
+    """
+    loans = iter(loans)
+    while True:
+        chunk = list(islice(loans, batch))
+        if not chunk:
+            return
+        book_of = {id: books.get(id) for id in {loan.book_id for loan in chunk}}
+        member_of = {id: members.get(id) for id in {loan.member_id for loan in chunk}}
+        for loan in chunk:
+            book = book_of[loan.book_id]
+            member = member_of[loan.member_id]
+            if complete and (book is None or member is None):
+                continue
+            yield LoanView(loan, book, member)
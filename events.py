@@ -0,0 +1,46 @@
+"""In-process event bus.
+
+Modules announce what happened with :func:`publish` and others react
+with :func:`subscribe`, without either importing the other. Handlers run
+synchronously in the publishing thread, in the order they subscribed,
+and usually inside the publisher's transaction, so they should be quick:
+log, queue or count, and leave slow work (mail, HTTP) to another thread.
+
+A handler that raises is logged and skipped; it never undoes the change
+that was announced, nor stops the other handlers.
+
+Events published by holds.py, each with ``hold=`` the Hold record:
+``hold_placed``, ``hold_ready``, ``hold_fulfilled``, ``hold_cancelled``
+and ``hold_expired``.
+"""
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+_handlers = {}
+_lock = threading.Lock()
+
+
+def subscribe(event, handler=None):
+    """Call ``handler(**data)`` on every ``publish(event, **data)``.
+
+    Also usable as a decorator: ``@subscribe("hold_ready")``.
+    """
+    if handler is None:
+        return lambda handler: subscribe(event, handler)
+    with _lock:
+        # Copy on write, so publish reads the list without the lock
+        _handlers[event] = _handlers.get(event, ()) + (handler,)
+    return handler
+
+
+def publish(event, **data):
+    """Call every handler subscribed to ``event``; return how many ran."""
+    handlers = _handlers.get(event, ())
+    for handler in handlers:
+        try:
+            handler(**data)
+        except Exception:
+            log.exception("Handler %r for %s failed", handler, event)
+    return len(handlers)
@@ -1,8 +1,36 @@
+from flask import current_app
 from flask_wtf import FlaskForm
-from wtforms import StringField, SelectField, IntegerField, TextAreaField, DateField, HiddenField
-from wtforms.validators import DataRequired, Email, Length, NumberRange, Optional
+from flask_wtf.file import FileField, FileRequired, FileAllowed
+from wtforms import StringField, SelectField, IntegerField, FloatField, TextAreaField, DateField, HiddenField
+from wtforms.validators import (
+    DataRequired, InputRequired, Email, Length, NumberRange, Optional, ValidationError
+)
 from datetime import datetime
 
+def book_label(book):
+    return f"{book.title} by {book.author} ({book.available_copies} of {book.total_copies} available)"
+
+def member_label(member):
+    return f"{member.name} <{member.email}>"
+
+class Exists:
+    """Validate a record id by fetching it from its table, in O(1).
+
+    Used instead of a SelectField's choices for fields filled in by a
+    typeahead box (see api.py's lookup routes), so the form never lists
+    the table. ``table`` is the app.config key; ``check`` narrows which
+    records are accepted.
+    """
+    def __init__(self, table, check=None, message='Not found'):
+        self.table = table
+        self.check = check
+        self.message = message
+
+    def __call__(self, form, field):
+        record = current_app.config[self.table].get(field.data)
+        if record is None or (self.check is not None and not self.check(record)):
+            raise ValidationError(self.message)
+
 class BookForm(FlaskForm):
     title = StringField('Title', validators=[DataRequired(), Length(min=1, max=100)])
     author = StringField('Author', validators=[DataRequired(), Length(min=1, max=100)])
@@ -13,7 +41,10 @@ class BookForm(FlaskForm):
         NumberRange(min=1000, max=datetime.now().year, message="Must be a valid year")
     ])
     description = TextAreaField('Description', validators=[Optional(), Length(max=500)])
-    status = SelectField('Status', choices=[('Available', 'Available'), ('Borrowed', 'Borrowed')])
+    # A title's status follows from its copies (see inventory.py)
+    total_copies = IntegerField('Copies', default=1, validators=[
+        InputRequired(), NumberRange(min=0, max=1000)
+    ])
 
 class MemberForm(FlaskForm):
     name = StringField('Name', validators=[DataRequired(), Length(min=1, max=100)])
@@ -22,12 +53,30 @@ class MemberForm(FlaskForm):
     membership_status = SelectField('Membership Status', 
                                    choices=[('Active', 'Active'), ('Inactive', 'Inactive')])
 
+def active_member(member):
+    return member.membership_status == 'Active'
+
 class BorrowForm(FlaskForm):
-    book_id = SelectField('Book', validators=[DataRequired()], coerce=int)
-    member_id = SelectField('Member', validators=[DataRequired()], coerce=int)
+    book_id = IntegerField('Book', validators=[
+        DataRequired('Choose a book'),
+        Exists('BOOKS', lambda book: book.available_copies, 'That book has no copy on the shelf')
+    ])
+    member_id = IntegerField('Member', validators=[
+        DataRequired('Choose a member'),
+        Exists('MEMBERS', active_member, 'Choose an active member')
+    ])
     borrow_date = DateField('Borrow Date', format='%Y-%m-%d', validators=[DataRequired()])
     due_date = DateField('Due Date', format='%Y-%m-%d', validators=[DataRequired()])
 
+class HoldForm(FlaskForm):
+    book_id = IntegerField('Book', validators=[
+        DataRequired('Choose a book'), Exists('BOOKS', message='Book not found')
+    ])
+    member_id = IntegerField('Member', validators=[
+        DataRequired('Choose a member'),
+        Exists('MEMBERS', active_member, 'Choose an active member')
+    ])
+
 class ReturnForm(FlaskForm):
     borrowing_id = HiddenField('Borrowing ID', validators=[DataRequired()])
     return_date = DateField('Return Date', format='%Y-%m-%d', validators=[DataRequired()])
@@ -39,4 +88,27 @@ class SearchForm(FlaskForm):
         ('', 'All Status'),
         ('Available', 'Available'),
         ('Borrowed', 'Borrowed')
-    ])
\ No newline at end of file
+    ])
+
+class BorrowingRecordForm(FlaskForm):
+    """One borrowing row from a bulk import; ids are checked by the importer."""
+    book_id = IntegerField('Book ID', validators=[DataRequired()])
+    member_id = IntegerField('Member ID', validators=[DataRequired()])
+    borrow_date = DateField('Borrow Date', format='%Y-%m-%d', validators=[DataRequired()])
+    due_date = DateField('Due Date', format='%Y-%m-%d', validators=[DataRequired()])
+    return_date = DateField('Return Date', format='%Y-%m-%d', validators=[Optional()])
+    status = SelectField('Status', choices=[
+        ('Borrowed', 'Borrowed'), ('Overdue', 'Overdue'), ('Returned', 'Returned')
+    ])
+    fine = FloatField('Fine', validators=[Optional(), NumberRange(min=0)])
+
+class ImportForm(FlaskForm):
+    kind = SelectField('Records', choices=[
+        ('books', 'Books'),
+        ('members', 'Members'),
+        ('borrowings', 'Borrowings')
+    ])
+    file = FileField('File', validators=[
+        FileRequired(),
+        FileAllowed(['csv', 'jsonl'], 'CSV or JSON Lines files only')
+    ])
@@ -0,0 +1,28 @@
+"""Production server: several worker processes sharing one database.
+
+    gunicorn -c gunicorn.conf.py
+
+Each worker is a separate process with its own in-memory tables and page
+cache, so reads scale across cores. The workers share the database named
+by DATABASE_URL (SQLite by default, or PostgreSQL), and each follows the
+others' writes through its change log (see shared.py). The memory and
+journal backends live inside one process and cannot be used here.
+
+WEB_CONCURRENCY sets the number of workers (default: one per core),
+THREADS the threads per worker and BIND the address.
+"""
+import multiprocessing
+import os
+
+# Read by app.py in each worker, which imports it after the fork
+os.environ.setdefault("DATABASE_URL", "sqlite:///library.db")
+os.environ.setdefault("SHARED_STORAGE", "1")
+
+wsgi_app = "main:app"
+bind = os.environ.get("BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "gthread"
+threads = int(os.environ.get("THREADS", 4))
+# Each worker loads its own tables and opens its own connections; nothing
+# is built in the master and inherited across the fork
+preload_app = False
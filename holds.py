@@ -0,0 +1,186 @@
+"""Holds: members queueing for titles with no copy on the shelf.
+
+A hold is Waiting in its title's queue, first come first served. When a
+copy comes back (a return, a new copy, an expired or cancelled hold),
+inventory.shelve sets it aside for the oldest waiting hold instead of
+putting it on the shelf: the hold turns Ready, and the member has
+``HOLD_PICKUP_DAYS`` to collect the copy before the hold expires and the
+copy goes to the next in line.
+
+Nothing here searches. :class:`HoldQueues` keeps each title's waiting
+holds in a deque, so the next holder is its head, O(1) whatever the size
+of the catalogue or the queue. Ready holds sit in the "expires" index by
+their last day, so the daily run expires just the ones at the front.
+
+Every step is announced on the event bus (see events.py). This module
+subscribes a handler that logs the "collect your book" notice; mail or
+SMS delivery would subscribe the same way.
+"""
+import logging
+from collections import deque
+from datetime import date
+
+from flask import current_app
+
+from events import publish, subscribe
+from inventory import shelve, take_held
+from models import (
+    Hold, Borrowing, ACTIVE, WAITING, READY, FULFILLED, CANCELLED, EXPIRED,
+    BORROWED, OVERDUE
+)
+
+log = logging.getLogger(__name__)
+
+# Statuses of a hold that still holds a place or a copy
+OPEN = (WAITING, READY)
+
+
+class HoldQueues:
+    """Table index of the Waiting holds of each title, oldest first.
+
+    Each deque is in hold id order, which is the order the holds were
+    placed; new holds, and records loading in id order, just append. A hold leaves
+    its queue when its status changes; the usual case, the head turning
+    Ready, is a popleft.
+    """
+
+    fields = ("status",)
+
+    def __init__(self):
+        self._queues = {}
+        self._count = 0
+
+    def add(self, hold):
+        if hold.status == WAITING:
+            queue = self._queues.get(hold.book_id)
+            if queue is None:
+                queue = self._queues[hold.book_id] = deque()
+            if queue and queue[-1].id > hold.id:
+                # A hold put back at its place, e.g. by an undone transaction
+                index = next(i for i, other in enumerate(queue) if other.id > hold.id)
+                queue.insert(index, hold)
+            else:
+                queue.append(hold)
+            self._count += 1
+
+    def remove(self, hold):
+        queue = self._queues.get(hold.book_id)
+        if hold.status != WAITING or not queue:
+            return
+        if queue[0] is hold:
+            queue.popleft()
+        else:
+            # A cancellation from the middle of the queue
+            queue.remove(hold)
+        self._count -= 1
+        if not queue:
+            del self._queues[hold.book_id]
+
+    def first(self, book_id):
+        """The oldest waiting hold on a title, or None."""
+        queue = self._queues.get(book_id)
+        return queue[0] if queue else None
+
+    def waiting(self, book_id):
+        """How many holds are waiting for a title."""
+        return len(self._queues.get(book_id, ()))
+
+    def position(self, hold):
+        """1 for the next in line, 2 for the one after, ..."""
+        return self._queues[hold.book_id].index(hold) + 1
+
+    def __len__(self):
+        return self._count
+
+
+def refusal(book, member):
+    """Why ``member`` cannot place a hold on ``book``, or None if they can."""
+    if book is None:
+        return "Book not found"
+    if member is None or member.membership_status != ACTIVE:
+        return "Only active members can place holds"
+    if book.available_copies:
+        return "A copy is on the shelf; borrow it instead"
+    holds = current_app.config["HOLDS"]
+    if any(hold.status in OPEN for hold in holds.lookup("member_id", member.id)
+           if hold.book_id == book.id):
+        return "This member already has a hold on this book"
+    return None
+
+
+def place_hold(book, member, today=None):
+    """Queue ``member`` for ``book``; the caller has checked :func:`refusal`."""
+    holds = current_app.config["HOLDS"]
+    hold = holds.add(Hold(holds.ids.next(), book.id, member.id, today or date.today()))
+    publish("hold_placed", hold=hold)
+    return hold
+
+
+def collect(hold, borrow_date, due_date):
+    """Lend the copy set aside for a Ready hold; return the new loan."""
+    config = current_app.config
+    copy = config["COPIES"].get(hold.copy_id)
+    take_held(copy)
+    loan = config["BORROWINGS"].add(Borrowing(
+        id=config["GET_NEXT_BORROWING_ID"](),
+        book_id=hold.book_id,
+        member_id=hold.member_id,
+        borrow_date=borrow_date,
+        due_date=due_date,
+        status=OVERDUE if due_date < date.today() else BORROWED,
+        copy_id=copy.id
+    ))
+    config["HOLDS"].update(hold, status=FULFILLED)
+    publish("hold_fulfilled", hold=hold)
+    return loan
+
+
+def cancel_hold(hold, release=True):
+    """Cancel an open hold, passing on any copy set aside for it.
+
+    With ``release`` off the copy is left alone, for a title that is
+    being deleted along with its copies.
+    """
+    config = current_app.config
+    was_ready = hold.status == READY
+    config["HOLDS"].update(hold, status=CANCELLED)
+    if was_ready and release:
+        copy = config["COPIES"].get(hold.copy_id)
+        if copy is not None:
+            shelve(copy)
+    publish("hold_cancelled", hold=hold)
+
+
+def cancel_holds(field, value, release=True):
+    """Cancel every open hold with ``field == value``; return how many."""
+    holds = current_app.config["HOLDS"]
+    # Waiting ones first, so a released copy skips the holds being cancelled
+    open_holds = sorted(
+        (hold for hold in holds.lookup(field, value) if hold.status in OPEN),
+        key=lambda hold: hold.status == READY
+    )
+    for hold in open_holds:
+        cancel_hold(hold, release)
+    return len(open_holds)
+
+
+def expire_holds(today=None):
+    """Expire Ready holds not collected by their last day; return how many."""
+    today = today or date.today()
+    config = current_app.config
+    holds, copies = config["HOLDS"], config["COPIES"]
+    # Copied first: each update takes the hold out of the index
+    expired = [hold for _, hold in holds.indexes["expires"].scan(stop=(today,))]
+    for hold in expired:
+        holds.update(hold, status=EXPIRED)
+        copy = copies.get(hold.copy_id)
+        if copy is not None:
+            shelve(copy, today)
+        publish("hold_expired", hold=hold)
+    return len(expired)
+
+
+@subscribe("hold_ready")
+def notify_ready(hold):
+    log.info("Hold %d: book %d is ready for member %d to collect by %s",
+             hold.id, hold.book_id, hold.member_id, hold.expires)
@@ -0,0 +1,181 @@
+"""Copies of each title, and the counters that summarize them.
+
+A Book is a title; each physical item is a Copy with its own barcode and
+status. Every title also carries ``total_copies`` and
+``available_copies``, and its ``status`` is Available while at least one
+copy is on the shelf. The book listings, status facets, borrow form and
+available report therefore keep reading the books table and its indexes,
+and never count copies.
+
+A copy that comes back while holds are waiting on its title does not
+reach the shelf: :func:`shelve` sets it aside (On Hold) for the oldest
+one and the counters do not move (see holds.py).
+
+Copies and counters only change through the functions here, which update
+both together. Callers hold a transaction, so a concurrent reader or
+writer never sees one without the other.
+"""
+from datetime import date, timedelta
+
+from flask import current_app
+
+from events import publish
+from models import Copy, AVAILABLE, BORROWED, ON_LOAN, ON_HOLD, READY
+
+
+def barcode_for(copy_id):
+    return f"C{copy_id:010d}"
+
+
+def title_status(available):
+    """A title's status for ``available`` copies on the shelf."""
+    return AVAILABLE if available else BORROWED
+
+
+def new_copies(books):
+    """Make ``book.total_copies`` copies of each new, not yet stored title.
+
+    Sets the titles' counters and status to match; the caller stores the
+    titles, then the returned copies.
+    """
+    copies = current_app.config["COPIES"]
+    wanted = [book.total_copies or 0 for book in books]
+    ids = iter(copies.ids.reserve(sum(wanted)))
+    made = []
+    for book, count in zip(books, wanted):
+        for _ in range(count):
+            id = next(ids)
+            made.append(Copy(id, book.id, barcode_for(id)))
+        book.update({
+            "total_copies": count, "available_copies": count, "status": title_status(count)
+        })
+    return made
+
+
+def _recount(book, total, available):
+    available += book.available_copies
+    current_app.config["BOOKS"].update(
+        book,
+        total_copies=book.total_copies + total,
+        available_copies=available,
+        status=title_status(available)
+    )
+
+
+def _set_aside(copy, hold, today=None):
+    config = current_app.config
+    config["COPIES"].update(copy, status=ON_HOLD)
+    expires = (today or date.today()) + timedelta(days=config["HOLD_PICKUP_DAYS"])
+    config["HOLDS"].update(hold, status=READY, copy_id=copy.id, expires=expires)
+    publish("hold_ready", hold=hold)
+
+
+def shelve(copy, today=None):
+    """Put ``copy`` back into circulation.
+
+    It goes to the oldest hold waiting on its title, if any, which is
+    returned; otherwise it goes on the shelf and None is returned.
+    """
+    config = current_app.config
+    hold = config["HOLDS"].indexes["queue"].first(copy.book_id)
+    if hold is not None:
+        _set_aside(copy, hold, today)
+        return hold
+    config["COPIES"].update(copy, status=AVAILABLE)
+    book = config["BOOKS"].get(copy.book_id)
+    if book is not None:
+        _recount(book, 0, 1)
+    return None
+
+
+def add_copies(book, count):
+    """Add ``count`` copies of a stored title: to its waiting holds, then the shelf."""
+    config = current_app.config
+    copies, queue = config["COPIES"], config["HOLDS"].indexes["queue"]
+    made = copies.add_many([Copy(id, book.id, barcode_for(id)) for id in copies.ids.reserve(count)])
+    held = min(count, queue.waiting(book.id))
+    _recount(book, count, count - held)
+    for copy in made[:held]:
+        _set_aside(copy, queue.first(book.id))
+
+
+def remove_copies(book, count):
+    """Withdraw ``count`` copies that are on the shelf.
+
+    Returns False, changing nothing, if fewer than that are on the shelf.
+    """
+    if count > book.available_copies:
+        return False
+    copies = current_app.config["COPIES"]
+    # Newest copies go first
+    for id in sorted(copies.match_ids(book_id=book.id, status=AVAILABLE))[-count:]:
+        copies.delete(id)
+    _recount(book, -count, -count)
+    return True
+
+
+def delete_copies(book_id):
+    """Delete every copy of a title that is being deleted."""
+    copies = current_app.config["COPIES"]
+    for copy in copies.lookup("book_id", book_id):
+        copies.delete(copy.id)
+
+
+def lend(book):
+    """Take a copy of ``book`` off the shelf and return it; None if none is left."""
+    if not book.available_copies:
+        return None
+    copies = current_app.config["COPIES"]
+    copy = copies.get(min(copies.match_ids(book_id=book.id, status=AVAILABLE)))
+    copies.update(copy, status=BORROWED)
+    _recount(book, 0, -1)
+    return copy
+
+
+def take_held(copy):
+    """Lend a copy that was set aside for a hold."""
+    current_app.config["COPIES"].update(copy, status=BORROWED)
+
+
+def give_back(loan):
+    """Put the copy lent on ``loan`` back into circulation (see :func:`shelve`).
+
+    Returns the hold it was set aside for, or None.
+    """
+    copies = current_app.config["COPIES"]
+    copy = copies.get(loan.copy_id) if loan.copy_id is not None else None
+    if copy is None or copy.status != BORROWED:
+        # A loan from before copies existed: any lent copy of the title
+        lent = copies.match_ids(book_id=loan.book_id, status=BORROWED)
+        copy = copies.get(min(lent)) if lent else None
+    if copy is None:
+        return None
+    return shelve(copy)
+
+
+def ensure_copies():
+    """Give each title from before copies existed one copy, in its state.
+
+    Loans still out on such a title are pointed at that copy. Returns
+    the number of titles changed.
+    """
+    config = current_app.config
+    books, copies, borrowings = config["BOOKS"], config["COPIES"], config["BORROWINGS"]
+    legacy = [book for book in books if book.total_copies is None]
+    if not legacy:
+        return 0
+    ids = copies.ids.reserve(len(legacy))
+    made = [
+        Copy(id, book.id, barcode_for(id), BORROWED if book.status == BORROWED else AVAILABLE)
+        for id, book in zip(ids, legacy)
+    ]
+    copies.add_many(made)
+    for book, copy in zip(legacy, made):
+        available = int(copy.status == AVAILABLE)
+        books.update(book, total_copies=1, available_copies=available,
+                     status=title_status(available))
+        if not available:
+            for loan in borrowings.lookup("book_id", book.id):
+                if loan.status in ON_LOAN and loan.copy_id is None:
+                    borrowings.update(loan, copy_id=copy.id)
+    return len(legacy)
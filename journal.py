@@ -0,0 +1,307 @@
+"""Append-only journal backend for the in-memory tables.
+
+Selected with ``DATABASE_URL=journal:////var/lib/library`` (four
+slashes for an absolute path; ``journal:///data`` is relative to the
+working directory). The tables stay in memory exactly as with
+``memory://``; every change is also appended to a journal file, so a
+restart rebuilds them instead of starting empty.
+
+Format: JSON Lines. Each line is one committed transaction, a list of
+operations:
+
+* ``["s", table, [field values...]]`` stores a whole record, in the
+  model's field order, with dates as ISO text;
+* ``["d", table, id]`` deletes one;
+* ``["m", key, value]`` sets a meta value (see ``get_meta``).
+
+A line only counts once its newline is on disk, so a crash in the middle
+of a write loses that transaction and nothing else.
+
+Group commit: a change is appended to an in-memory queue while the write
+lock is held, and made durable by :meth:`JournalBackend.sync`, which the
+app calls after each transaction and each request, outside the lock.
+The first thread to call it writes and fsyncs everything queued so far;
+threads arriving meanwhile wait for that fsync or the next one, so many
+concurrent writers share a few fsyncs instead of paying one each.
+
+Snapshots: after ``snapshot_every`` operations a background thread
+starts a new journal segment (under the write lock, which is quick), then
+writes every record to a snapshot file without the lock. Records may
+change while they are copied; the new segment holds those changes, and
+replaying it over the snapshot gives the right result because every
+operation stores a whole record. Older segments and snapshots are then
+deleted. Startup reads the newest snapshot and the segments after it.
+
+Snapshots hold most of the data, so they are written for fast loading
+rather than for reading by eye: pickled chunks of field-value tuples,
+which load about three times faster than the same rows as JSON. Like a
+database file, the data directory must only be writable by the app.
+"""
+import atexit
+import json
+import logging
+import os
+import pickle
+import re
+import threading
+from contextlib import contextmanager
+from datetime import date
+from itertools import islice
+
+log = logging.getLogger(__name__)
+
+# Operations between snapshots
+SNAPSHOT_EVERY = 1_000_000
+# Records per line of a snapshot file
+SNAPSHOT_CHUNK = 1000
+
+FILE_TYPES = {"journal": "jsonl", "snapshot": "pickle"}
+FILE_NAME = re.compile(r"(journal|snapshot)-(\d+)\.(jsonl|pickle)$")
+
+
+def _encode(ops):
+    # str(date) is its ISO form; everything else is plain JSON already
+    return (json.dumps(ops, separators=(",", ":"), default=str) + "\n").encode()
+
+
+class JournalBackend:
+    """Journal files in ``directory``, replayed when the app starts."""
+
+    def __init__(self, directory, snapshot_every=SNAPSHOT_EVERY):
+        self.directory = directory
+        self.snapshot_every = snapshot_every
+        self._tables = ()
+        self._models = {}
+        self._meta = {}
+        self._local = threading.local()
+        # Guards the queue and the counters below; never held during I/O
+        self._lock = threading.Lock()
+        self._synced_cond = threading.Condition(self._lock)
+        self._queue = []
+        self._queued = 0     # lines queued so far
+        self._synced = 0     # lines known to be on disk
+        self.fsyncs = 0
+        self._syncing = False
+        self._since_snapshot = 0
+        self._snapshotting = False
+
+        os.makedirs(directory, exist_ok=True)
+        self._rows = {}
+        segment = self._replay()
+        # New writes always start a fresh segment, created on first use
+        self._segment = segment + 1
+        self._file = None
+        atexit.register(self.close)
+
+    def _path(self, kind, number):
+        return os.path.join(self.directory, f"{kind}-{number:06d}.{FILE_TYPES[kind]}")
+
+    def _files(self, kind):
+        found = []
+        for name in os.listdir(self.directory):
+            match = FILE_NAME.match(name)
+            if match and match.group(1) == kind and match.group(3) == FILE_TYPES[kind]:
+                found.append(int(match.group(2)))
+        return sorted(found)
+
+    # Startup
+    def _replay(self):
+        """Read the newest snapshot and later segments; return the last segment."""
+        snapshots = self._files("snapshot")
+        first = snapshots[-1] if snapshots else 0
+        if snapshots:
+            self._load_snapshot(self._path("snapshot", first))
+        segments = [n for n in self._files("journal") if n >= first]
+        for number in segments:
+            self._replay_file(self._path("journal", number))
+        return max(segments + [first])
+
+    def _load_snapshot(self, path):
+        rows = self._rows
+        with open(path, "rb") as f:
+            self._meta.update(pickle.load(f))
+            while True:
+                try:
+                    name, chunk = pickle.load(f)
+                except EOFError:
+                    break
+                table = rows.get(name)
+                if table is None:
+                    table = rows[name] = {}
+                table.update({values[0]: values for values in chunk})
+
+    def _replay_file(self, path):
+        rows, meta = self._rows, self._meta
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    log.warning("Ignoring a partly written transaction at the end of %s", path)
+                    break
+                for op, name, data in json.loads(line):
+                    if op == "s":
+                        table = rows.get(name)
+                        if table is None:
+                            table = rows[name] = {}
+                        table[data[0]] = data
+                    elif op == "d":
+                        rows.get(name, {}).pop(data, None)
+                    else:
+                        meta[name] = data
+
+    def create(self, model):
+        self._models[model.table] = model
+
+    def load(self, model):
+        """Yield the replayed records of ``model``, by id."""
+        rows = self._rows.pop(model.table, {})
+        dates = [i for i, kind in enumerate(model.fields.values()) if kind is date]
+        for id in sorted(rows):
+            values = rows.pop(id)
+            if type(values) is list:
+                # From the journal, where dates are ISO text
+                for i in dates:
+                    if i < len(values) and values[i] is not None:
+                        values[i] = date.fromisoformat(values[i])
+            # Positional, in field order: much cheaper than keywords at 10M rows
+            yield model(*values)
+
+    def attach(self, *tables):
+        """Tables to copy into snapshots; their lock is the write lock."""
+        self._tables = tables
+
+    # Writes
+    def _values(self, table, record):
+        return [getattr(record, name) for name in self._models[table].fields]
+
+    def _append(self, ops):
+        pending = getattr(self._local, "ops", None)
+        if pending is not None:
+            pending.extend(ops)
+            return
+        line = _encode(ops)
+        with self._lock:
+            self._queue.append(line)
+            self._queued += 1
+            self._local.seq = self._queued
+            self._since_snapshot += len(ops)
+            snapshot = (
+                self._since_snapshot >= self.snapshot_every
+                and self._tables and not self._snapshotting
+            )
+            if snapshot:
+                self._snapshotting = True
+        if snapshot:
+            threading.Thread(target=self.snapshot, name="snapshot", daemon=True).start()
+
+    def save(self, table, record):
+        self._append([["s", table, self._values(table, record)]])
+
+    def save_many(self, table, records):
+        self._append([["s", table, self._values(table, record)] for record in records])
+
+    def delete(self, table, id):
+        self._append([["d", table, id]])
+
+    def get_meta(self, key):
+        return self._meta.get(key)
+
+    def set_meta(self, key, value):
+        self._append([["m", key, value]])
+        self._meta[key] = value
+
+    @contextmanager
+    def transaction(self):
+        """Queue the writes inside as one journal line, or none on error."""
+        if getattr(self._local, "ops", None) is not None:
+            yield
+            return
+        self._local.ops = []
+        try:
+            yield
+        except BaseException:
+            self._local.ops = None
+            raise
+        ops, self._local.ops = self._local.ops, None
+        if ops:
+            self._append(ops)
+
+    def release(self):
+        pass
+
+    def sync(self, upto=None):
+        """Wait until this thread's writes (or the first ``upto`` lines) are on disk."""
+        target = getattr(self._local, "seq", 0) if upto is None else upto
+        with self._lock:
+            while self._synced < target:
+                if self._syncing:
+                    self._synced_cond.wait()
+                    continue
+                # Lead: write out everything queued so far with one fsync
+                self._syncing = True
+                lines, self._queue = self._queue, []
+                end = self._queued
+                self._lock.release()
+                try:
+                    if self._file is None:
+                        self._file = open(self._path("journal", self._segment), "ab")
+                    self._file.write(b"".join(lines))
+                    self._file.flush()
+                    os.fsync(self._file.fileno())
+                    self.fsyncs += 1
+                finally:
+                    self._lock.acquire()
+                    self._syncing = False
+                    self._synced_cond.notify_all()
+                self._synced = end
+
+    def close(self):
+        self.sync(self._queued)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    # Snapshots
+    def snapshot(self):
+        """Start a new segment, then snapshot the attached tables into it."""
+        try:
+            with self._tables[0].lock:
+                # Everything before this point is in memory and in the old segment
+                self.sync(self._queued)
+                with self._lock:
+                    old, self._file = self._file, None
+                    self._segment += 1
+                    self._since_snapshot = 0
+                    segment = self._segment
+                    meta = dict(self._meta)
+                if old is not None:
+                    old.close()
+            self.write_snapshot(segment, meta)
+            for kind in ("journal", "snapshot"):
+                for number in self._files(kind):
+                    if number < segment:
+                        os.remove(self._path(kind, number))
+        except Exception:
+            log.exception("Journal snapshot failed")
+        finally:
+            self._snapshotting = False
+
+    def write_snapshot(self, segment, meta):
+        """Copy every attached table into ``snapshot-<segment>``."""
+        path = self._path("snapshot", segment)
+        with open(path + ".tmp", "wb") as f:
+            # One self-contained pickle per chunk, read back one at a time
+            pickle.dump(meta, f, protocol=pickle.HIGHEST_PROTOCOL)
+            for table in self._tables:
+                names = list(self._models[table.name].fields)
+                records = iter(table)
+                while True:
+                    chunk = list(islice(records, SNAPSHOT_CHUNK))
+                    if not chunk:
+                        break
+                    pickle.dump((table.name, [
+                        tuple([getattr(record, name) for name in names]) for record in chunk
+                    ]), f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        log.info("Wrote journal snapshot %s", path)
@@ -0,0 +1,116 @@
+"""Listing queries shared by the HTML pages and the JSON API.
+
+Each function reads its filters and cursor from the current request and
+returns one :class:`pagination.Page`, so a page and its API twin always
+list the same rows in the same order.
+"""
+from flask import current_app, request
+
+from enrich import join_loans
+from models import WAITING
+from pagination import (
+    paginate, id_cursor, date_cursor, encode_date_cursor, ranked_after
+)
+
+
+def books_page():
+    """Books by id, or best match first for ``?query=``; filtered by
+    ``?category=`` and ``?status=``."""
+    books = current_app.config["BOOKS"]
+    # Apply filters if any, using the search and field indexes
+    filters = {
+        field: request.args.get(field)
+        for field in ('category', 'status')
+        if request.args.get(field)
+    }
+    after = id_cursor()
+    if request.args.get('query'):
+        # Ranked best match first
+        ids = books.indexes["text"].search(request.args.get('query'))
+        if filters:
+            allowed = books.match_ids(**filters)
+            ids = [id for id in ids if id in allowed]
+        total = len(ids)
+        ids = ranked_after(ids, after)
+    elif filters:
+        total = books.match_count(**filters)
+        ids = books.match_after(after, **filters)
+    else:
+        total = len(books)
+        ids = books.ids_after(after)
+    # Ids are taken up front and read as the page renders: skip any
+    # record deleted in between (a streamed listing takes a while)
+    return paginate(filter(None, map(books.get, ids)), lambda book: book.id, total)
+
+
+def members_page():
+    """Members by id, or best match first for ``?query=``."""
+    members = current_app.config["MEMBERS"]
+    search_query = request.args.get('query', '')
+    after = id_cursor()
+    if search_query:
+        ids = members.indexes["text"].search(search_query)
+        total = len(ids)
+        ids = ranked_after(ids, after)
+    else:
+        total = len(members)
+        ids = members.ids_after(after)
+    return paginate(filter(None, map(members.get, ids)), lambda member: member.id, total)
+
+
+def borrowings_page():
+    """All loans with their book and member, newest first."""
+    borrowings = current_app.config["BORROWINGS"]
+    # Newest first, straight from the borrow_date index
+    newest = borrowings.indexes["borrow_date"].scan(start=date_cursor(), reverse=True)
+    return paginate(
+        join_loans((borrow for _, borrow in newest), current_app.config["BOOKS"],
+                   current_app.config["MEMBERS"]),
+        lambda b: encode_date_cursor(b.borrow_date, b.id),
+        len(borrowings)
+    )
+
+
+def overdue_page():
+    """Overdue loans, most overdue first."""
+    overdue_index = current_app.config["BORROWINGS"].indexes["overdue"]
+    overdue = overdue_index.scan(start=date_cursor())
+    return paginate(
+        join_loans((b for _, b in overdue), current_app.config["BOOKS"],
+                   current_app.config["MEMBERS"]),
+        lambda b: encode_date_cursor(b.due_date, b.id),
+        len(overdue_index)
+    )
+
+
+def holds_page():
+    """Ready holds, soonest to expire first; or with ``?status=Waiting``,
+    waiting holds, oldest first."""
+    holds = current_app.config["HOLDS"]
+    if request.args.get("status") == WAITING:
+        waiting = holds.indexes["waiting"]
+        after = id_cursor()
+        rows = (hold for _, hold in waiting.scan(start=None if after is None else (after, after)))
+        cursor_of, total = (lambda hold: hold.id), len(waiting)
+    else:
+        ready = holds.indexes["expires"]
+        rows = (hold for _, hold in ready.scan(start=date_cursor()))
+        cursor_of, total = (lambda hold: encode_date_cursor(hold.expires, hold.id)), len(ready)
+    return paginate(
+        join_loans(rows, current_app.config["BOOKS"], current_app.config["MEMBERS"]),
+        cursor_of,
+        total
+    )
+
+
+def available_page(category=''):
+    """Available books by id, optionally in one category."""
+    books = current_app.config["BOOKS"]
+    filters = {"status": "Available"}
+    if category:
+        filters["category"] = category
+    return paginate(
+        filter(None, map(books.get, books.match_after(id_cursor(), **filters))),
+        lambda book: book.id,
+        books.match_count(**filters)
+    )
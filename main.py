@@ -1,5 +1,8 @@
 from app import app
 from routes import *
+import api  # registers the /api/v1 routes
 
+# Development server, one process. In production run several workers on
+# a shared database: gunicorn -c gunicorn.conf.py
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=True)
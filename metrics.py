@@ -0,0 +1,228 @@
+"""Opt-in request metrics and a sampling profiler.
+
+Turned on with ``METRICS=1``. For every route this records:
+
+* a latency histogram, reported as p50/p95/p99;
+* time spent rendering templates, and the rest of the request time
+  (the handler's data access), measured with Flask's template signals;
+* records read from the tables and indexes (``store.scanned``).
+
+``GET /metrics`` reports all of it in the Prometheus text format.
+
+The sampling profiler can be started and stopped while the app runs:
+``POST /metrics/profiler`` with ``action=start`` or ``action=stop``.
+While it runs, a background thread records the stack of every other
+thread every ``interval`` seconds (``interval=`` on start, at least
+``MIN_INTERVAL``). ``GET /metrics/profile`` returns the counts as
+collapsed stacks, one ``frame;frame;frame count`` per line, which flame
+graph tools read directly.
+"""
+import bisect
+import math
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import Response, g, request, template_rendered, before_render_template
+
+from store import scanned
+
+# Histogram bucket upper bounds in seconds: 50us to about 80s, 25% apart
+BUCKETS = tuple(50e-6 * 1.25 ** i for i in range(65))
+
+# Shortest profiler interval accepted; shorter ones would have the sampler
+# walking every thread's stack nonstop
+MIN_INTERVAL = 0.001
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class RouteStats:
+    """Latency histogram and totals for one route."""
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.render = 0.0
+        self.scanned = 0
+
+    def record(self, elapsed, render, scanned):
+        self.buckets[bisect.bisect_left(BUCKETS, elapsed)] += 1
+        self.count += 1
+        self.total += elapsed
+        self.render += render
+        self.scanned += scanned
+
+    def quantile(self, q):
+        """Estimate the ``q`` quantile, interpolating inside its bucket."""
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            if n and seen + n >= rank:
+                low = BUCKETS[i - 1] if i else 0.0
+                high = BUCKETS[i] if i < len(BUCKETS) else BUCKETS[-1]
+                return low + (high - low) * (rank - seen) / n
+            seen += n
+        return 0.0
+
+
+class Profiler:
+    """Samples the stacks of all threads from a background thread."""
+
+    def __init__(self, interval=0.005, depth=40):
+        self.interval = interval
+        self.depth = depth
+        self.samples = Counter()
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.depth:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self.samples[";".join(reversed(stack))] += 1
+
+    def collapsed(self):
+        # Copy first: the sampling thread keeps adding to the counter
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self.samples.copy().most_common()
+        )
+
+
+class Metrics:
+    """Collects per-route timings for ``app`` and serves /metrics."""
+
+    def __init__(self, app):
+        self.routes = {}
+        self.profiler = Profiler()
+        self._lock = threading.Lock()
+        self._app = app
+        app.before_request(self._before)
+        app.after_request(self._after)
+        before_render_template.connect(self._render_started, app)
+        template_rendered.connect(self._render_finished, app)
+        app.add_url_rule("/metrics", "metrics", self.report)
+        app.add_url_rule("/metrics/profile", "metrics_profile", self.profile)
+        app.add_url_rule(
+            "/metrics/profiler", "metrics_profiler", self.toggle_profiler, methods=["POST"]
+        )
+
+    def _before(self):
+        g.metrics_start = time.perf_counter()
+        g.metrics_render = 0.0
+        g.metrics_scanned = scanned.count
+
+    def _render_started(self, sender, template, context, **extra):
+        g.metrics_render_start = time.perf_counter()
+
+    def _render_finished(self, sender, template, context, **extra):
+        started = g.get("metrics_render_start")
+        if started is not None:
+            g.metrics_render = g.get("metrics_render", 0.0) + time.perf_counter() - started
+
+    def _after(self, response):
+        start = g.get("metrics_start")
+        if start is None:
+            return response
+        route = request.url_rule.rule if request.url_rule else "(unmatched)"
+        if response.is_streamed:
+            # A streamed listing renders as it is sent, after this hook:
+            # record it once the server has sent the body and closes it
+            state = g._get_current_object()
+            response.call_on_close(lambda: self._record(route, start, state))
+        else:
+            self._record(route, start, g)
+        return response
+
+    def _record(self, route, start, state):
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            stats = self.routes.get(route)
+            if stats is None:
+                stats = self.routes[route] = RouteStats()
+            stats.record(
+                elapsed, state.get("metrics_render", 0.0), scanned.count - state.metrics_scanned
+            )
+
+    def report(self):
+        lines = [
+            "# HELP library_request_seconds Request latency by route.",
+            "# TYPE library_request_seconds summary",
+        ]
+        with self._lock:
+            routes = sorted(self.routes.items())
+            for route, stats in routes:
+                for q in QUANTILES:
+                    lines.append(
+                        f'library_request_seconds{{route="{route}",quantile="{q}"}} '
+                        f"{stats.quantile(q):.6f}"
+                    )
+                lines.append(f'library_request_seconds_sum{{route="{route}"}} {stats.total:.6f}')
+                lines.append(f'library_request_seconds_count{{route="{route}"}} {stats.count}')
+            for name, description, value in (
+                ("render_seconds", "Time spent rendering templates.", lambda s: f"{s.render:.6f}"),
+                ("data_seconds", "Request time outside template rendering.",
+                 lambda s: f"{s.total - s.render:.6f}"),
+                ("records_scanned", "Records read from tables and indexes.", lambda s: s.scanned),
+            ):
+                lines.append(f"# HELP library_{name}_total {description}")
+                lines.append(f"# TYPE library_{name}_total counter")
+                for route, stats in routes:
+                    lines.append(f'library_{name}_total{{route="{route}"}} {value(stats)}')
+        cache = self._app.config.get("PAGE_CACHE")
+        if cache is not None:
+            lines.append("# TYPE library_page_cache gauge")
+            for key, value in cache.stats().items():
+                lines.append(f'library_page_cache{{stat="{key}"}} {value}')
+        lines.append("# TYPE library_profiler_running gauge")
+        lines.append(f"library_profiler_running {int(self.profiler.running)}")
+        return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+    def profile(self):
+        return Response(self.profiler.collapsed(), mimetype="text/plain")
+
+    def toggle_profiler(self):
+        action = request.values.get("action")
+        if action == "start":
+            if "interval" in request.values:
+                try:
+                    interval = float(request.values["interval"])
+                except ValueError:
+                    interval = math.nan
+                if not (math.isfinite(interval) and interval >= MIN_INTERVAL):
+                    return Response(f"interval must be a number of seconds, at least {MIN_INTERVAL}\n",
+                                    status=400, mimetype="text/plain")
+                self.profiler.interval = interval
+            self.profiler.start()
+        elif action == "stop":
+            self.profiler.stop()
+        elif action == "reset":
+            self.profiler.samples.clear()
+        else:
+            return Response("action must be start, stop or reset\n", status=400, mimetype="text/plain")
+        return Response(f"profiler {'running' if self.profiler.running else 'stopped'}\n",
+                        mimetype="text/plain")
@@ -1,39 +1,184 @@
-from datetime import datetime, timedelta
+import sys
+from datetime import datetime, date, timedelta
 
-# Models are defined here for reference, but we're using in-memory dictionaries
-# for the MVP instead of a database ORM
+# These classes are the in-memory record format. They use __slots__, so a
+# record stores its field values and nothing else: there is no per-instance
+# dict and no room for ad-hoc attributes. Each model's `table`, `fields`
+# (column name -> Python type) and `indexed` columns also describe how the
+# storage backends in storage.py lay the records out in a database.
+# Constructor arguments come in `fields` order, so a stored row of values
+# can be passed straight to the class.
 
-class Book:
-    def __init__(self, id, title, author, isbn, category, published_year, status="Available", description=""):
+# Dates are stored as datetime.date objects. They are converted once, when a
+# record is written, so handlers and templates can compare and render them
+# directly. str(date) gives the same YYYY-MM-DD text the forms use.
+DATE_FORMAT = "%Y-%m-%d"
+
+def to_date(value):
+    """Convert a YYYY-MM-DD string or datetime to a date; None stays None."""
+    if isinstance(value, str):
+        return datetime.strptime(value, DATE_FORMAT).date()
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+# Status values. Fields listed in a model's `interned` are passed through
+# sys.intern on write, so every record shares one string object per value
+# instead of holding its own copy from the submitted form.
+AVAILABLE = "Available"
+BORROWED = "Borrowed"
+RETURNED = "Returned"
+OVERDUE = "Overdue"
+ACTIVE = "Active"
+INACTIVE = "Inactive"
+# Holds (see holds.py), and a copy set aside for a Ready one
+WAITING = "Waiting"
+READY = "Ready"
+FULFILLED = "Fulfilled"
+CANCELLED = "Cancelled"
+EXPIRED = "Expired"
+ON_HOLD = "On Hold"
+
+# A loan is on loan (the book is out) while Borrowed and after it turns
+# Overdue; scheduler.py moves it from one to the other when it falls due
+ON_LOAN = (BORROWED, OVERDUE)
+
+class Model:
+    """Base class for the slot-based record classes."""
+    __slots__ = ()
+    fields = {}
+    interned = ()
+
+    def update(self, changes):
+        """Set several fields at once (the same call a dict would take)."""
+        for name, value in changes.items():
+            if name in self.interned and value is not None:
+                value = sys.intern(value)
+            setattr(self, name, value)
+
+    def replace(self, **changes):
+        """Return a copy of this record with ``changes`` applied."""
+        return type(self)(**{**self.to_dict(), **changes})
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.fields}
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+class Book(Model):
+    """A title. The physical items on the shelf are its Copy records.
+
+    ``total_copies`` and ``available_copies`` are kept up to date by
+    inventory.py on every lend, return and copy change, and ``status``
+    follows them: Available while at least one copy is on the shelf. None
+    means the title predates copies and has not been given any yet.
+    """
+    table = "books"
+    fields = {
+        "id": int, "title": str, "author": str, "isbn": str, "category": str,
+        "published_year": int, "status": str, "description": str,
+        "total_copies": int, "available_copies": int
+    }
+    indexed = ("category", "status")
+    interned = ("category", "status")
+    __slots__ = tuple(fields)
+
+    def __init__(self, id, title, author, isbn, category, published_year, status=AVAILABLE, description="",
+                 total_copies=None, available_copies=None):
         self.id = id
         self.title = title
         self.author = author
         self.isbn = isbn
-        self.category = category
+        self.category = sys.intern(category)
         self.published_year = published_year
-        self.status = status  # "Available", "Borrowed"
+        self.status = sys.intern(status)  # "Available", "Borrowed"
         self.description = description
+        self.total_copies = total_copies
+        self.available_copies = available_copies
+
+class Copy(Model):
+    """One physical copy of a title, identified by its barcode."""
+    table = "copies"
+    fields = {"id": int, "book_id": int, "barcode": str, "status": str}
+    indexed = ("book_id", "barcode")
+    interned = ("status",)
+    __slots__ = tuple(fields)
 
-class Member:
-    def __init__(self, id, name, email, phone, join_date=None, membership_status="Active"):
+    def __init__(self, id, book_id, barcode, status=AVAILABLE):
+        self.id = id
+        self.book_id = book_id
+        self.barcode = barcode
+        self.status = sys.intern(status)  # "Available", "Borrowed", "On Hold"
+
+class Member(Model):
+    table = "members"
+    fields = {
+        "id": int, "name": str, "email": str, "phone": str, "join_date": date,
+        "membership_status": str
+    }
+    indexed = ()
+    interned = ("membership_status",)
+    __slots__ = tuple(fields)
+
+    def __init__(self, id, name, email, phone, join_date=None, membership_status=ACTIVE):
         self.id = id
         self.name = name
         self.email = email
         self.phone = phone
-        self.join_date = join_date or datetime.now().strftime("%Y-%m-%d")
-        self.membership_status = membership_status  # "Active", "Inactive"
+        self.join_date = to_date(join_date) or date.today()
+        self.membership_status = sys.intern(membership_status)  # "Active", "Inactive"
+
+class Borrowing(Model):
+    table = "borrowings"
+    fields = {
+        "id": int, "book_id": int, "member_id": int, "borrow_date": date,
+        "due_date": date, "return_date": date, "status": str, "fine": float,
+        "copy_id": int
+    }
+    indexed = ("book_id", "member_id", "status", "due_date", "borrow_date")
+    interned = ("status",)
+    __slots__ = tuple(fields)
 
-class Borrowing:
-    def __init__(self, id, book_id, member_id, borrow_date=None, due_date=None):
+    def __init__(self, id, book_id, member_id, borrow_date=None, due_date=None, return_date=None, status=BORROWED, fine=0.0,
+                 copy_id=None):
         self.id = id
         self.book_id = book_id
         self.member_id = member_id
-        self.borrow_date = borrow_date or datetime.now().strftime("%Y-%m-%d")
+        self.borrow_date = to_date(borrow_date) or date.today()
         # Default due date is 14 days from borrow date
         if due_date:
-            self.due_date = due_date
+            self.due_date = to_date(due_date)
         else:
-            borrow_datetime = datetime.strptime(self.borrow_date, "%Y-%m-%d")
-            self.due_date = (borrow_datetime + timedelta(days=14)).strftime("%Y-%m-%d")
-        self.return_date = None
-        self.status = "Borrowed"  # "Borrowed", "Returned", "Overdue"
+            self.due_date = self.borrow_date + timedelta(days=14)
+        self.return_date = to_date(return_date)
+        self.status = sys.intern(status)  # "Borrowed", "Returned", "Overdue"
+        # Late fee, fixed when the book comes back (see scheduler.fine_for)
+        self.fine = fine or 0.0
+        # The copy lent out; None only for loans from before copies existed
+        self.copy_id = copy_id
+
+class Hold(Model):
+    """A member's place in the queue for a title with no copy on the shelf.
+
+    Waiting until a copy comes back, then Ready with that copy set aside
+    until ``expires``; Fulfilled when the member collects it.
+    """
+    table = "holds"
+    fields = {
+        "id": int, "book_id": int, "member_id": int, "placed_date": date,
+        "status": str, "copy_id": int, "expires": date
+    }
+    indexed = ("book_id", "member_id", "status")
+    interned = ("status",)
+    __slots__ = tuple(fields)
+
+    def __init__(self, id, book_id, member_id, placed_date=None, status=WAITING, copy_id=None, expires=None):
+        self.id = id
+        self.book_id = book_id
+        self.member_id = member_id
+        self.placed_date = to_date(placed_date) or date.today()
+        self.status = sys.intern(status)  # "Waiting", "Ready", "Fulfilled", "Cancelled", "Expired"
+        # The copy set aside, and the last day to collect it, once Ready
+        self.copy_id = copy_id
+        self.expires = to_date(expires)
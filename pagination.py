@@ -0,0 +1,175 @@
+"""Keyset pagination helpers for the listing and report pages.
+
+Each listing passes an iterator that already starts after the cursor
+from the query string. ``paginate`` reads one page from it, plus one
+extra row to learn whether a next page exists, so earlier pages are
+never built.
+
+Cursors are opaque to the user. Id-ordered listings use the last id
+(``?after=42``). Date-ordered listings use the last ``(date, id)`` pair
+(``?after=2024-05-01.42``).
+
+Streaming: on the HTML listings (views marked :func:`streamable`), with
+``?stream=1`` a listing is not cut into pages. Its page
+holds every remaining row as a :class:`RowStream`, which pulls rows from
+the index one at a time, and :func:`render_listing` sends the template
+out in chunks while it renders, so the first rows reach the browser at
+once and a request holds a few rows and one chunk in memory however
+long the listing is.
+"""
+from datetime import date
+from functools import wraps
+from itertools import chain, islice
+
+from flask import (
+    Response, current_app, g, render_template, request, stream_template, url_for
+)
+
+# Characters of rendered output gathered before each write to the client
+STREAM_CHUNK = 16 * 1024
+
+
+class Page:
+    """One page of a listing and the links around it."""
+
+    def __init__(self, items, next_cursor, total, streamed=False):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.total = total
+        self.streamed = streamed
+
+    @property
+    def is_first(self):
+        return not request.args.get("after")
+
+    @property
+    def first_url(self):
+        return _url(after=None)
+
+    @property
+    def next_url(self):
+        return _url(after=self.next_cursor) if self.next_cursor else None
+
+    @property
+    def all_url(self):
+        """The whole listing, streamed, from the start."""
+        return _url(after=None, per_page=None, stream="1")
+
+
+def _url(**changes):
+    args = request.args.to_dict()
+    args.update(changes)
+    args = {key: value for key, value in args.items() if value is not None}
+    return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+
+class RowStream:
+    """The rows of a streamed page, read as the template loops over them.
+
+    True if there is at least one row, so templates can still show their
+    empty state; that check reads one row ahead and nothing more.
+    """
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._head = None
+
+    def __bool__(self):
+        if self._head is None:
+            self._head = list(islice(self._rows, 1))
+        return bool(self._head)
+
+    def __iter__(self):
+        head, self._head = self._head or (), ()
+        return chain(head, self._rows)
+
+
+def streamable(view):
+    """Let ``?stream=1`` stream this view's listing; goes above
+    ``cached_page``, which leaves streamed requests alone."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.streamable = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def streaming():
+    """Whether this request streams its whole listing (see :func:`streamable`).
+
+    The JSON API shares the listing queries but not this: its pages
+    stay bounded by ``per_page``.
+    """
+    return g.get("streamable", False) and request.args.get("stream") == "1"
+
+
+def page_size():
+    """Page size from ``?per_page=``, bounded by the app config."""
+    size = request.args.get("per_page", current_app.config["PAGE_SIZE"], type=int)
+    return max(1, min(size, current_app.config["MAX_PAGE_SIZE"]))
+
+
+def paginate(rows, cursor_of, total):
+    """Read one page from ``rows``; ``cursor_of(row)`` builds its cursor.
+
+    When :func:`streaming`, the page is all of ``rows``, unread.
+    """
+    if streaming():
+        return Page(RowStream(rows), None, total, streamed=True)
+    size = page_size()
+    items = list(islice(rows, size + 1))
+    next_cursor = cursor_of(items[size - 1]) if len(items) > size else None
+    return Page(items[:size], next_cursor, total)
+
+
+def id_cursor():
+    return request.args.get("after", type=int)
+
+
+def date_cursor():
+    """Parse a ``YYYY-MM-DD.id`` cursor into a ``(date, id)`` entry."""
+    value = request.args.get("after", "")
+    day, _, id = value.partition(".")
+    try:
+        return date.fromisoformat(day), int(id)
+    except ValueError:
+        return None
+
+
+def encode_date_cursor(day, id):
+    return f"{day.isoformat()}.{id}"
+
+
+def ranked_after(ids, after):
+    """Ids from the ranked list ``ids`` that come after ``after``.
+
+    Empty if ``after`` has dropped out of the results since the previous
+    page: starting again from the top would repeat page one.
+    """
+    if after is None:
+        return iter(ids)
+    try:
+        return iter(ids[ids.index(after) + 1:])
+    except ValueError:
+        return iter(())
+
+
+def _chunked(pieces, size=STREAM_CHUNK):
+    # Jinja yields many small pieces; join them into fewer, larger writes
+    buffer, length = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        length += len(piece)
+        if length >= size:
+            yield "".join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield "".join(buffer)
+
+
+def render_listing(template_name, **context):
+    """``render_template`` for a listing page, or with ``?stream=1`` a
+    response that renders and sends it chunk by chunk."""
+    if not streaming():
+        return render_template(template_name, **context)
+    return Response(_chunked(stream_template(template_name, **context)), mimetype="text/html")
@@ -1,10 +1,25 @@
 from flask import (
     render_template, redirect, url_for, flash, request, session,
-    abort, jsonify
+    abort, jsonify, Response, stream_with_context
 )
 from app import app
-from forms import BookForm, MemberForm, BorrowForm, ReturnForm, SearchForm
+from forms import (
+    BookForm, MemberForm, BorrowForm, HoldForm, ReturnForm, SearchForm, ImportForm,
+    book_label, member_label, active_member
+)
+from bulk import KINDS, read_rows, import_rows, export_rows
+from cache import cached_page, cached_choices
+from pagination import streamable, render_listing
+from models import Book, Member, Borrowing, BORROWED, OVERDUE, RETURNED, ON_LOAN
+from scheduler import fine_for, outstanding_fines
+from inventory import new_copies, add_copies, remove_copies, delete_copies, lend, give_back
+from holds import OPEN, refusal, place_hold, collect, cancel_hold, cancel_holds
+from enrich import join_loans
+from listings import (
+    books_page, members_page, borrowings_page, overdue_page, available_page, holds_page
+)
 from datetime import datetime, timedelta, date 
+from itertools import islice
 
 # Home route
 @app.route('/')
@@ -13,46 +28,23 @@ def index():
     members = app.config["MEMBERS"]
     borrowings = app.config["BORROWINGS"]
 
-    # Count statistics
+    # Count statistics. The status indexes keep these counts up to date on
+    # every add/edit/delete/borrow/return, so nothing is scanned here.
     total_books = len(books)
-    available_books = sum(1 for book in books if book["status"] == "Available")
+    available_books = books.count("status", "Available")
     borrowed_books = total_books - available_books
     total_members = len(members)
+    active_loans = borrowings.count("status", BORROWED) + borrowings.count("status", OVERDUE)
 
-    # Get recent activity (last 5 borrowings)
-    recent_borrowings = sorted(
-        borrowings,
-        key=lambda x: datetime.strptime(x["borrow_date"], "%Y-%m-%d")
-        if isinstance(x["borrow_date"], str) else x["borrow_date"],
-        reverse=True
-    )[:5]
-
-    # Enhance with book/member info and normalize due_date to date
-    for borrow in recent_borrowings:
-        book = next((b for b in books if b["id"] == borrow["book_id"]), None)
-        member = next((m for m in members if m["id"] == borrow["member_id"]), None)
-        if book and member:
-            borrow["book_title"] = book["title"]
-            borrow["member_name"] = member["name"]
-        # Convert due_date to date object if it's a string
-        if isinstance(borrow["due_date"], str):
-            borrow["due_date"] = datetime.strptime(borrow["due_date"], "%Y-%m-%d").date()
-        elif isinstance(borrow["due_date"], datetime):
-            borrow["due_date"] = borrow["due_date"].date()
-
-    # Normalize all due_dates in borrowings for comparison
-    for borrow in borrowings:
-        if isinstance(borrow["due_date"], str):
-            borrow["due_date"] = datetime.strptime(borrow["due_date"], "%Y-%m-%d").date()
-        elif isinstance(borrow["due_date"], datetime):
-            borrow["due_date"] = borrow["due_date"].date()
+    # Get recent activity (last 5 borrowings), newest end of the borrow_date index
+    recent = (borrow for _, borrow in borrowings.indexes["borrow_date"].scan(reverse=True))
+    recent_borrowings = list(islice(join_loans(recent, books, members, complete=False), 5))
 
     today = date.today()  # Only use date for clean comparison
 
-    overdue_count = sum(
-        1 for borrow in borrowings
-        if borrow["status"] == "Borrowed" and borrow["due_date"] < today
-    )
+    # The scheduler marks loans Overdue, so these are index reads too
+    overdue_count = borrowings.count("status", OVERDUE)
+    fines_owed = outstanding_fines(today)
 
     return render_template(
         'index.html',
@@ -61,57 +53,57 @@ def index():
         borrowed_books=borrowed_books,
         total_members=total_members,
         recent_borrowings=recent_borrowings,
+        active_loans=active_loans,
         overdue_count=overdue_count,
+        fines_owed=fines_owed,
         now_date=today
     )
 
 # Book routes
 @app.route('/books')
+@streamable
+@cached_page("BOOKS")
 def books_index():
     books = app.config["BOOKS"]
     search_form = SearchForm()
     
-    # Get unique categories for filter dropdown
-    categories = sorted(list(set(book["category"] for book in books)))
-    search_form.category.choices = [('', 'All Categories')] + [(c, c) for c in categories]
-    
-    # Apply filters if any
-    filtered_books = books
-    if request.args.get('query'):
-        query = request.args.get('query').lower()
-        filtered_books = [
-            book for book in filtered_books 
-            if query in book["title"].lower() or 
-               query in book["author"].lower() or 
-               query in book["isbn"].lower()
-        ]
-    
-    if request.args.get('category') and request.args.get('category') != '':
-        category = request.args.get('category')
-        filtered_books = [book for book in filtered_books if book["category"] == category]
-    
-    if request.args.get('status') and request.args.get('status') != '':
-        status = request.args.get('status')
-        filtered_books = [book for book in filtered_books if book["status"] == status]
-    
-    return render_template('books/index.html', books=filtered_books, form=search_form)
+    # Filter dropdowns with a count per option, read from the facet indexes
+    # and rebuilt only after the books change
+    search_form.category.choices = cached_choices("category", ("BOOKS",), lambda: [
+        ('', 'All Categories')
+    ] + [
+        (category, f"{category} ({count})")
+        for category, count in books.indexes["category"].facets()
+    ])
+    status_counts = cached_choices("status", ("BOOKS",), lambda: dict(books.indexes["status"].facets()))
+    search_form.status.choices = [
+        (value, f"{label} ({status_counts.get(value, 0)})" if value else label)
+        for value, label in search_form.status.choices
+    ]
+    
+    # Search, filter and paginate using the indexes (see listings.py)
+    page = books_page()
+    return render_listing('books/index.html', books=page.items, page=page, form=search_form)
 
 @app.route('/books/add', methods=['GET', 'POST'])
 def books_add():
     form = BookForm()
     if form.validate_on_submit():
         books = app.config["BOOKS"]
-        new_book = {
-            "id": app.config["GET_NEXT_BOOK_ID"](),
-            "title": form.title.data,
-            "author": form.author.data,
-            "isbn": form.isbn.data,
-            "category": form.category.data,
-            "published_year": form.published_year.data,
-            "description": form.description.data,
-            "status": form.status.data
-        }
-        books.append(new_book)
+        new_book = Book(
+            id=app.config["GET_NEXT_BOOK_ID"](),
+            title=form.title.data,
+            author=form.author.data,
+            isbn=form.isbn.data,
+            category=form.category.data,
+            published_year=form.published_year.data,
+            description=form.description.data,
+            total_copies=form.total_copies.data
+        )
+        with app.config["TRANSACTION"]():
+            copies = new_copies([new_book])
+            books.add(new_book)
+            app.config["COPIES"].add_many(copies)
         flash('Book added successfully!', 'success')
         return redirect(url_for('books_index'))
     return render_template('books/add.html', form=form)
@@ -119,7 +111,7 @@ def books_add():
 @app.route('/books/<int:id>')
 def books_view(id):
     books = app.config["BOOKS"]
-    book = next((book for book in books if book["id"] == id), None)
+    book = books.get(id)
     if not book:
         flash('Book not found', 'danger')
         return redirect(url_for('books_index'))
@@ -127,20 +119,25 @@ def books_view(id):
     # Get borrowing history for this book
     borrowings = app.config["BORROWINGS"]
     members = app.config["MEMBERS"]
-    book_borrowings = [b for b in borrowings if b["book_id"] == id]
     
-    # Add member names to borrowings
-    for borrow in book_borrowings:
-        member = next((m for m in members if m["id"] == borrow["member_id"]), None)
-        if member:
-            borrow["member_name"] = member["name"]
+    # Join member names onto the borrowings
+    book_borrowings = list(join_loans(
+        borrowings.lookup("book_id", id), books, members, complete=False
+    ))
     
-    return render_template('books/view.html', book=book, borrowings=book_borrowings)
+    return render_template(
+        'books/view.html',
+        book=book,
+        copies=sorted(app.config["COPIES"].lookup("book_id", id), key=lambda copy: copy.id),
+        waiting=app.config["HOLDS"].indexes["queue"].waiting(id),
+        borrowings=book_borrowings,
+        now_date=date.today()
+    )
 
 @app.route('/books/edit/<int:id>', methods=['GET', 'POST'])
 def books_edit(id):
     books = app.config["BOOKS"]
-    book = next((book for book in books if book["id"] == id), None)
+    book = books.get(id)
     if not book:
         flash('Book not found', 'danger')
         return redirect(url_for('books_index'))
@@ -148,22 +145,37 @@ def books_edit(id):
     form = BookForm(obj=None)
     
     if request.method == 'GET':
-        form.title.data = book["title"]
-        form.author.data = book["author"]
-        form.isbn.data = book["isbn"]
-        form.category.data = book["category"]
-        form.published_year.data = book["published_year"]
-        form.description.data = book["description"]
-        form.status.data = book["status"]
+        form.title.data = book.title
+        form.author.data = book.author
+        form.isbn.data = book.isbn
+        form.category.data = book.category
+        form.published_year.data = book.published_year
+        form.description.data = book.description
+        form.total_copies.data = book.total_copies
     
     if form.validate_on_submit():
-        book["title"] = form.title.data
-        book["author"] = form.author.data
-        book["isbn"] = form.isbn.data
-        book["category"] = form.category.data
-        book["published_year"] = form.published_year.data
-        book["description"] = form.description.data
-        book["status"] = form.status.data
+        with app.config["TRANSACTION"]():
+            # Copies on loan cannot be withdrawn, so check before changing anything
+            change = form.total_copies.data - book.total_copies
+            resized = change >= 0 or -change <= book.available_copies
+            if resized:
+                books.update(
+                    book,
+                    title=form.title.data,
+                    author=form.author.data,
+                    isbn=form.isbn.data,
+                    category=form.category.data,
+                    published_year=form.published_year.data,
+                    description=form.description.data
+                )
+                if change > 0:
+                    add_copies(book, change)
+                elif change < 0:
+                    remove_copies(book, -change)
+        
+        if not resized:
+            flash(f'Only {book.available_copies} copies are on the shelf to remove', 'danger')
+            return render_template('books/edit.html', form=form, book=book)
         
         flash('Book updated successfully!', 'success')
         return redirect(url_for('books_index'))
@@ -175,19 +187,22 @@ def books_delete(id):
     books = app.config["BOOKS"]
     borrowings = app.config["BORROWINGS"]
     
-    # Check if book is currently borrowed
-    is_borrowed = any(
-        b["book_id"] == id and b["status"] == "Borrowed" 
-        for b in borrowings
-    )
+    # Check and delete atomically, so a concurrent borrow cannot slip in
+    with app.config["TRANSACTION"]():
+        # Check if book is currently borrowed
+        is_borrowed = any(
+            b.status in ON_LOAN
+            for b in borrowings.lookup("book_id", id)
+        )
+        deleted = None if is_borrowed else books.delete(id)
+        if deleted is not None:
+            # Copies set aside for holds go with the rest
+            cancel_holds("book_id", id, release=False)
+            delete_copies(id)
     
     if is_borrowed:
         flash('Cannot delete book that is currently borrowed', 'danger')
-        return redirect(url_for('books_index'))
-    
-    book_idx = next((i for i, book in enumerate(books) if book["id"] == id), None)
-    if book_idx is not None:
-        del books[book_idx]
+    elif deleted is not None:
         flash('Book deleted successfully!', 'success')
     else:
         flash('Book not found', 'danger')
@@ -196,36 +211,25 @@ def books_delete(id):
 
 # Member routes
 @app.route('/members')
+@streamable
 def members_index():
-    members = app.config["MEMBERS"]
-    search_query = request.args.get('query', '').lower()
-    
-    if search_query:
-        filtered_members = [
-            member for member in members 
-            if search_query in member["name"].lower() or 
-               search_query in member["email"].lower() or 
-               search_query in member["phone"].lower()
-        ]
-    else:
-        filtered_members = members
-    
-    return render_template('members/index.html', members=filtered_members)
+    page = members_page()
+    return render_listing('members/index.html', members=page.items, page=page)
 
 @app.route('/members/add', methods=['GET', 'POST'])
 def members_add():
     form = MemberForm()
     if form.validate_on_submit():
         members = app.config["MEMBERS"]
-        new_member = {
-            "id": app.config["GET_NEXT_MEMBER_ID"](),
-            "name": form.name.data,
-            "email": form.email.data,
-            "phone": form.phone.data,
-            "join_date": datetime.now().strftime("%Y-%m-%d"),
-            "membership_status": form.membership_status.data
-        }
-        members.append(new_member)
+        new_member = Member(
+            id=app.config["GET_NEXT_MEMBER_ID"](),
+            name=form.name.data,
+            email=form.email.data,
+            phone=form.phone.data,
+            join_date=date.today(),
+            membership_status=form.membership_status.data
+        )
+        members.add(new_member)
         flash('Member added successfully!', 'success')
         return redirect(url_for('members_index'))
     return render_template('members/add.html', form=form)
@@ -233,7 +237,7 @@ def members_add():
 @app.route('/members/<int:id>')
 def members_view(id):
     members = app.config["MEMBERS"]
-    member = next((member for member in members if member["id"] == id), None)
+    member = members.get(id)
     if not member:
         flash('Member not found', 'danger')
         return redirect(url_for('members_index'))
@@ -241,30 +245,35 @@ def members_view(id):
     # Get borrowing history for this member
     borrowings = app.config["BORROWINGS"]
     books = app.config["BOOKS"]
-    member_borrowings = [b for b in borrowings if b["member_id"] == id]
     
-    # Add book titles to borrowings
-    for borrow in member_borrowings:
-        book = next((b for b in books if b["id"] == borrow["book_id"]), None)
-        if book:
-            borrow["book_title"] = book["title"]
-        # Convert due_date from string to date object if it's not already
-        if isinstance(borrow["due_date"], str):
-            borrow["due_date"] = datetime.strptime(borrow["due_date"], "%Y-%m-%d").date()
+    # Join book titles onto the borrowings
+    member_borrowings = list(join_loans(
+        borrowings.lookup("member_id", id), books, members, complete=False
+    ))
     
     # Calculate statistics
     total_borrowed = len(member_borrowings)
-    currently_borrowed = sum(1 for b in member_borrowings if b["status"] == "Borrowed")
+    currently_borrowed = sum(1 for b in member_borrowings if b.status in ON_LOAN)
     today = date.today()
-    overdue_books = sum(
-        1 for b in member_borrowings 
-        if b["status"] == "Borrowed" and b["due_date"] < today
+    overdue_books = sum(1 for b in member_borrowings if b.status == OVERDUE)
+    
+    # Open holds, with each waiting one's place in its queue
+    holds = app.config["HOLDS"]
+    queue = holds.indexes["queue"]
+    open_holds = sorted(
+        (hold for hold in holds.lookup("member_id", id) if hold.status in OPEN),
+        key=lambda hold: hold.id
     )
+    member_holds = [
+        (view, queue.position(hold) if hold.status == "Waiting" else None)
+        for hold, view in zip(open_holds, join_loans(open_holds, books, members, complete=False))
+    ]
     
     return render_template(
         'members/view.html', 
         member=member, 
         borrowings=member_borrowings,
+        holds=member_holds,
         total_borrowed=total_borrowed,
         currently_borrowed=currently_borrowed,
         overdue_books=overdue_books,
@@ -274,7 +283,7 @@ def members_view(id):
 @app.route('/members/edit/<int:id>', methods=['GET', 'POST'])
 def members_edit(id):
     members = app.config["MEMBERS"]
-    member = next((member for member in members if member["id"] == id), None)
+    member = members.get(id)
     if not member:
         flash('Member not found', 'danger')
         return redirect(url_for('members_index'))
@@ -282,16 +291,19 @@ def members_edit(id):
     form = MemberForm(obj=None)
     
     if request.method == 'GET':
-        form.name.data = member["name"]
-        form.email.data = member["email"]
-        form.phone.data = member["phone"]
-        form.membership_status.data = member["membership_status"]
+        form.name.data = member.name
+        form.email.data = member.email
+        form.phone.data = member.phone
+        form.membership_status.data = member.membership_status
     
     if form.validate_on_submit():
-        member["name"] = form.name.data
-        member["email"] = form.email.data
-        member["phone"] = form.phone.data
-        member["membership_status"] = form.membership_status.data
+        members.update(
+            member,
+            name=form.name.data,
+            email=form.email.data,
+            phone=form.phone.data,
+            membership_status=form.membership_status.data
+        )
         
         flash('Member updated successfully!', 'success')
         return redirect(url_for('members_index'))
@@ -303,19 +315,21 @@ def members_delete(id):
     members = app.config["MEMBERS"]
     borrowings = app.config["BORROWINGS"]
     
-    # Check if member has any active borrowings
-    has_active_borrowings = any(
-        b["member_id"] == id and b["status"] == "Borrowed" 
-        for b in borrowings
-    )
+    # Check and delete atomically, so a concurrent borrow cannot slip in
+    with app.config["TRANSACTION"]():
+        # Check if member has any active borrowings
+        has_active_borrowings = any(
+            b.status in ON_LOAN
+            for b in borrowings.lookup("member_id", id)
+        )
+        deleted = None if has_active_borrowings else members.delete(id)
+        if deleted is not None:
+            # Pass any copies set aside for the member to the next in line
+            cancel_holds("member_id", id)
     
     if has_active_borrowings:
         flash('Cannot delete member with active borrowings', 'danger')
-        return redirect(url_for('members_index'))
-    
-    member_idx = next((i for i, member in enumerate(members) if member["id"] == id), None)
-    if member_idx is not None:
-        del members[member_idx]
+    elif deleted is not None:
         flash('Member deleted successfully!', 'success')
     else:
         flash('Member not found', 'danger')
@@ -324,59 +338,38 @@ def members_delete(id):
 
 # Borrowing routes
 @app.route("/borrow")
+@streamable
 def borrow_index():
-    borrowings = app.config["BORROWINGS"]
-    books = app.config["BOOKS"]
-    members = app.config["MEMBERS"]
-    
-    borrowings_with_details = []
-    for borrow in borrowings:
-        book = next((b for b in books if b["id"] == borrow["book_id"]), None)
-        member = next((m for m in members if m["id"] == borrow["member_id"]), None)
-
-        if book and member:
-            borrowing_copy = borrow.copy()
-            borrowing_copy["book_title"] = book["title"]
-            borrowing_copy["member_name"] = member["name"]
-            
-            # ✅ Safe handling for due_date
-            due_date = borrow["due_date"]
-            if isinstance(due_date, str):
-                borrowing_copy["due_date_obj"] = datetime.strptime(due_date, "%Y-%m-%d").date()
-            elif isinstance(due_date, datetime):
-                borrowing_copy["due_date_obj"] = due_date.date()
-            else:
-                borrowing_copy["due_date_obj"] = due_date
-
-            borrowings_with_details.append(borrowing_copy)
+    # Newest first, straight from the borrow_date index
+    page = borrowings_page()
     
-    borrowings_with_details.sort(
-        key=lambda x: datetime.strptime(x["borrow_date"], "%Y-%m-%d"), 
-        reverse=True
-    )
-    
-    now_date = datetime.now().date()
+    now_date = date.today()
 
-    return render_template(
+    return render_listing(
         'borrow/index.html',
-        borrowings=borrowings_with_details,
+        borrowings=page.items,
+        page=page,
         now_date=now_date
     )
 
 
+def chosen_labels(form):
+    """What the typeahead boxes show for the ids already in ``form``."""
+    book = app.config["BOOKS"].get(form.book_id.data)
+    member = app.config["MEMBERS"].get(form.member_id.data)
+    return {
+        "book_choice": book_label(book) if book else "",
+        "member_choice": member_label(member) if member else "",
+    }
+
 @app.route('/borrow/add', methods=['GET', 'POST'])
 def borrow_add():
     books = app.config["BOOKS"]
-    members = app.config["MEMBERS"]
-    
-    # Filter only available books
-    available_books = [book for book in books if book["status"] == "Available"]
-    # Filter only active members
-    active_members = [member for member in members if member["membership_status"] == "Active"]
     
-    form = BorrowForm()
-    form.book_id.choices = [(book["id"], f"{book['title']} by {book['author']}") for book in available_books]
-    form.member_id.choices = [(member["id"], member["name"]) for member in active_members]
+    # The book and member boxes look records up as the user types (see the
+    # lookup routes in api.py) and the form checks just the chosen ids, so
+    # neither table is listed here
+    form = BorrowForm(book_id=request.args.get('book_id', type=int))
     
     # Set default dates
     if request.method == 'GET':
@@ -386,38 +379,50 @@ def borrow_add():
     if form.validate_on_submit():
         borrowings = app.config["BORROWINGS"]
         
-        # Add new borrowing record
-        new_borrowing = {
-            "id": app.config["GET_NEXT_BORROWING_ID"](),
-            "book_id": form.book_id.data,
-            "member_id": form.member_id.data,
-            "borrow_date": form.borrow_date.data.strftime("%Y-%m-%d"),
-            "due_date": form.due_date.data.strftime("%Y-%m-%d"),
-            "return_date": None,
-            "status": "Borrowed"
-        }
-        borrowings.append(new_borrowing)
+        # The form checked the book and member without the lock, so check
+        # both again while holding it: checking and lending must be one
+        # atomic step, and either may have been deleted meanwhile
+        with app.config["TRANSACTION"]():
+            book = books.get(form.book_id.data)
+            member = app.config["MEMBERS"].get(form.member_id.data)
+            if member is None or not active_member(member):
+                copy, error = None, 'That member was removed or made inactive meanwhile'
+            else:
+                copy = lend(book) if book else None
+                error = 'The last copy of that book was just borrowed by someone else'
+            if copy is not None:
+                # Add new borrowing record
+                new_borrowing = Borrowing(
+                    id=app.config["GET_NEXT_BORROWING_ID"](),
+                    book_id=form.book_id.data,
+                    member_id=form.member_id.data,
+                    borrow_date=form.borrow_date.data,
+                    due_date=form.due_date.data,
+                    # Already late if entered after the fact
+                    status=OVERDUE if form.due_date.data < date.today() else BORROWED,
+                    copy_id=copy.id
+                )
+                borrowings.add(new_borrowing)
         
-        # Update book status
-        book = next((book for book in books if book["id"] == form.book_id.data), None)
-        if book:
-            book["status"] = "Borrowed"
+        if copy is None:
+            flash(error, 'warning')
+            return redirect(url_for('borrow_add'))
         
         flash('Book borrowed successfully!', 'success')
         return redirect(url_for('borrow_index'))
     
-    return render_template('borrow/add.html', form=form)
+    return render_template('borrow/add.html', form=form, **chosen_labels(form))
 
 @app.route('/borrow/return/<int:id>', methods=['GET', 'POST'])
 def borrow_return(id):
     borrowings = app.config["BORROWINGS"]
-    borrowing = next((b for b in borrowings if b["id"] == id), None)
+    borrowing = borrowings.get(id)
     
     if not borrowing:
         flash('Borrowing record not found', 'danger')
         return redirect(url_for('borrow_index'))
     
-    if borrowing["status"] == "Returned":
+    if borrowing.status == "Returned":
         flash('This book has already been returned', 'warning')
         return redirect(url_for('borrow_index'))
     
@@ -428,24 +433,37 @@ def borrow_return(id):
         form.return_date.data = datetime.now()
     
     if form.validate_on_submit():
-        # Update borrowing record
-        borrowing["return_date"] = form.return_date.data.strftime("%Y-%m-%d")
-        borrowing["status"] = "Returned"
+        with app.config["TRANSACTION"]():
+            # Re-check under the lock so two returns cannot both go through
+            returned = borrowing.status == "Returned"
+            if not returned:
+                # Update borrowing record
+                borrowings.update(
+                    borrowing,
+                    return_date=form.return_date.data,
+                    status=RETURNED,
+                    fine=fine_for(borrowing, form.return_date.data, app.config["FINE_PER_DAY"])
+                )
+                
+                # Put the copy back on the shelf, or aside for the next hold
+                hold = give_back(borrowing)
         
-        # Update book status
-        books = app.config["BOOKS"]
-        book = next((book for book in books if book["id"] == borrowing["book_id"]), None)
-        if book:
-            book["status"] = "Available"
+        if returned:
+            flash('This book has already been returned', 'warning')
+            return redirect(url_for('borrow_index'))
         
         flash('Book returned successfully!', 'success')
+        if hold is not None:
+            member = app.config["MEMBERS"].get(hold.member_id)
+            flash(f'Set the copy aside for {member.name if member else "a hold"} '
+                  f'until {hold.expires}', 'info')
         return redirect(url_for('borrow_index'))
     
     # Get book and member details for display
     books = app.config["BOOKS"]
     members = app.config["MEMBERS"]
-    book = next((b for b in books if b["id"] == borrowing["book_id"]), None)
-    member = next((m for m in members if m["id"] == borrowing["member_id"]), None)
+    book = books.get(borrowing.book_id)
+    member = members.get(borrowing.member_id)
     
     return render_template(
         'borrow/return.html', 
@@ -455,66 +473,139 @@ def borrow_return(id):
         member=member
     )
 
-# Reports routes
-@app.route('/reports/overdue')
-def reports_overdue():
-    borrowings = app.config["BORROWINGS"]
+# Hold routes
+@app.route('/holds')
+@streamable
+def holds_index():
+    return render_listing(
+        'holds/index.html',
+        page=holds_page(),
+        status=request.args.get('status') or 'Ready',
+        now_date=date.today()
+    )
+
+@app.route('/holds/add', methods=['GET', 'POST'])
+def holds_add():
     books = app.config["BOOKS"]
     members = app.config["MEMBERS"]
     
-    today = datetime.now().date()  # Get today's date without time
-    overdue_borrowings = []
-
-    for b in borrowings:
-        if b["status"] == "Borrowed":
-            # Ensure due_date is a datetime.date object
-            due_date = b["due_date"]
-            if isinstance(due_date, str):
-                due_date = datetime.strptime(due_date, "%Y-%m-%d").date()  # Convert string to date
-            elif isinstance(due_date, datetime):
-                due_date = due_date.date()  # Convert datetime to date
-            
-            # Check if due_date is before today (i.e., overdue)
-            if due_date < today:
-                b_copy = b.copy()  # Avoid modifying the original data
-                
-                # Add book and member details
-                book = next((bk for bk in books if bk["id"] == b["book_id"]), None)
-                member = next((m for m in members if m["id"] == b["member_id"]), None)
+    # Typeahead boxes, as on the borrow form; only titles with no copy on
+    # the shelf are offered
+    form = HoldForm(book_id=request.args.get('book_id', type=int))
+    
+    if form.validate_on_submit():
+        # Checked again under the lock: a copy may have come back meanwhile
+        with app.config["TRANSACTION"]():
+            book = books.get(form.book_id.data)
+            member = members.get(form.member_id.data)
+            error = refusal(book, member)
+            if error is None:
+                hold = place_hold(book, member)
+                position = app.config["HOLDS"].indexes["queue"].position(hold)
+        
+        if error is not None:
+            flash(error, 'warning')
+            return redirect(url_for('holds_add'))
+        
+        flash(f'Hold placed: number {position} in the queue', 'success')
+        return redirect(url_for('holds_index', status='Waiting'))
+    
+    return render_template('holds/add.html', form=form, **chosen_labels(form))
 
-                if book and member:
-                    b_copy["book_title"] = book["title"]
-                    b_copy["book_author"] = book["author"]
-                    b_copy["member_name"] = member["name"]
-                    b_copy["member_email"] = member["email"]
-                    b_copy["member_phone"] = member["phone"]
-                    b_copy["days_overdue"] = (today - due_date).days
+@app.route('/holds/<int:id>/collect', methods=['POST'])
+def holds_collect(id):
+    holds = app.config["HOLDS"]
+    
+    with app.config["TRANSACTION"]():
+        hold = holds.get(id)
+        ready = hold is not None and hold.status == "Ready"
+        if ready:
+            today = date.today()
+            collect(hold, today, today + timedelta(days=14))
+    
+    if not ready:
+        flash('That hold has no copy waiting to be collected', 'warning')
+        return redirect(url_for('holds_index'))
+    
+    flash('Book borrowed successfully!', 'success')
+    return redirect(url_for('borrow_index'))
 
-                    overdue_borrowings.append(b_copy)
+@app.route('/holds/<int:id>/cancel', methods=['POST'])
+def holds_cancel(id):
+    holds = app.config["HOLDS"]
+    
+    with app.config["TRANSACTION"]():
+        hold = holds.get(id)
+        cancelled = hold is not None and hold.status in OPEN
+        if cancelled:
+            status = hold.status
+            cancel_hold(hold)
+    
+    if cancelled:
+        flash('Hold cancelled', 'success')
+        return redirect(url_for('holds_index', status=status))
+    
+    flash('Hold not found or already closed', 'warning')
+    return redirect(url_for('holds_index'))
 
-    # Sort by most overdue first
-    overdue_borrowings.sort(key=lambda x: x.get("days_overdue", 0), reverse=True)
-    
-    return render_template('reports/overdue.html', borrowings=overdue_borrowings)
+# Reports routes
+@app.route('/reports/overdue')
+@streamable
+@cached_page("BORROWINGS", "BOOKS", "MEMBERS", daily=True)
+def reports_overdue():
+    # Overdue loans, oldest due date (most overdue) first
+    page = overdue_page()
+    return render_listing('reports/overdue.html', borrowings=page.items, page=page)
 
 @app.route('/reports/available')
+@streamable
+@cached_page("BOOKS")
 def reports_available():
     books = app.config["BOOKS"]
     
-    # Filter only available books
-    available_books = [book for book in books if book["status"] == "Available"]
-    
-    # Apply category filter if provided
+    # Filter only available books, and by category if provided
     category = request.args.get('category', '')
-    if category:
-        available_books = [book for book in available_books if book["category"] == category]
+    page = available_page(category)
     
-    # Get all unique categories for filter
-    categories = sorted(list(set(book["category"] for book in books)))
+    # All categories for the filter, kept sorted by the category index
+    categories = books.indexes["category"].values()
     
-    return render_template(
+    return render_listing(
         'reports/available.html', 
-        books=available_books,
+        books=page.items,
+        page=page,
         categories=categories,
         selected_category=category
     )
+
+# Bulk import and export routes
+@app.route('/import', methods=['GET', 'POST'])
+def bulk_import():
+    form = ImportForm()
+    report = None
+    if form.validate_on_submit():
+        report = import_rows(form.kind.data, read_rows(form.file.data))
+        # Scripts that ask for JSON get the report as JSON
+        if request.accept_mimetypes.best == 'application/json':
+            return jsonify(report)
+        flash(
+            f"Imported {report['imported']} {report['kind']}, {report['failed']} row(s) rejected",
+            'success' if not report['failed'] else 'warning'
+        )
+    return render_template('bulk/import.html', form=form, report=report, kinds=KINDS)
+
+@app.route('/export/<kind>.<format>')
+def bulk_export(kind, format):
+    if kind not in KINDS or format not in ('csv', 'jsonl'):
+        abort(404)
+    mimetype = 'text/csv' if format == 'csv' else 'application/x-ndjson'
+    return Response(
+        stream_with_context(export_rows(kind, format)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={kind}.{format}'}
+    )
+
+@app.route('/cache/stats')
+def cache_stats():
+    cache = app.config["PAGE_CACHE"]
+    return jsonify(cache.stats() if cache else {"enabled": False})
@@ -0,0 +1,142 @@
+"""Daily job that moves loans past their due date to "Overdue".
+
+A loan is Borrowed until its due date passes, then Overdue until it is
+returned. The "due_date" index holds only Borrowed loans, ordered by due
+date, so the loans that fell due since the last run are exactly its
+entries before today: a run reads those and nothing else, however many
+loans are already overdue. The overdue report and the dashboard counter
+are then plain lookups on the status.
+
+Fines are not rewritten every day. An overdue loan owes ``rate`` per day
+late; :class:`OverdueTotals` keeps the count and the summed due dates of
+the overdue loans up to date as they change, so the total owed is one
+multiplication. A loan's fine is stored on it when it is returned.
+
+The same run expires holds whose copy was not collected in time (see
+holds.expire_holds), passing each copy to the next in line.
+
+The job runs from a timer thread just after midnight and, in case the
+process was not running then, on the first request of a new day. The
+date of the last run is kept in storage and statuses are written through
+like any other change, so a restart carries on where the last run left.
+"""
+import logging
+import threading
+from datetime import date, datetime, timedelta
+
+from flask import current_app
+
+from holds import expire_holds
+from models import OVERDUE, to_date
+
+log = logging.getLogger(__name__)
+
+LAST_RUN = "overdue_last_run"
+
+
+def fine_for(loan, returned, rate):
+    """Fine for ``loan`` if it comes back on ``returned``."""
+    late = (to_date(returned) - loan.due_date).days
+    return round(late * rate, 2) if late > 0 else 0.0
+
+
+class OverdueTotals:
+    """Table index of how many loans are overdue and how late they are.
+
+    Attached like any other index, so every status change and return
+    keeps it current. ``totals`` is swapped in as one tuple, so readers
+    never see a count from one write and a sum from another.
+    """
+
+    fields = ("status", "due_date")
+
+    def __init__(self):
+        self.totals = (0, 0)
+
+    def add(self, record):
+        if record.status == OVERDUE:
+            count, due = self.totals
+            self.totals = (count + 1, due + record.due_date.toordinal())
+
+    def remove(self, record):
+        if record.status == OVERDUE:
+            count, due = self.totals
+            self.totals = (count - 1, due - record.due_date.toordinal())
+
+    def __len__(self):
+        return self.totals[0]
+
+    def owed(self, today, rate):
+        """Fines owed on all overdue loans as of ``today``."""
+        count, due = self.totals
+        return round((count * today.toordinal() - due) * rate, 2)
+
+
+class OverdueScheduler:
+    """Marks loans overdue once a day for ``app``."""
+
+    def __init__(self, app):
+        self.app = app
+        last_run = app.config["STORAGE"].get_meta(LAST_RUN)
+        self.last_run = to_date(last_run) if last_run else None
+        self._thread = None
+        self._stop = threading.Event()
+        app.before_request(self.run_if_due)
+
+    def run(self, today=None):
+        """Mark Borrowed loans due before ``today`` overdue and expire
+        uncollected holds; return how many loans were marked."""
+        today = today or date.today()
+        config = self.app.config
+        borrowings = config["BORROWINGS"]
+        with self.app.app_context(), config["TRANSACTION"]():
+            # Copied first: each update takes the loan out of the index
+            due = [loan for _, loan in borrowings.indexes["due_date"].scan(stop=(today,))]
+            for loan in due:
+                borrowings.update(loan, status=OVERDUE)
+            expired = expire_holds(today)
+            config["STORAGE"].set_meta(LAST_RUN, today.isoformat())
+            self.last_run = today
+        log.info("Marked %d loans overdue and expired %d holds for %s", len(due), expired, today)
+        return len(due)
+
+    def run_if_due(self):
+        """Run now if today's run has not happened yet."""
+        today = date.today()
+        if self.last_run != today:
+            with self.app.config["TRANSACTION"]():
+                # Checked again under the lock, so only one request runs it
+                if self.last_run != today:
+                    self.run(today)
+
+    def start(self):
+        """Start the thread that runs the job just after each midnight."""
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="overdue", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _loop(self):
+        while True:
+            midnight = datetime.combine(date.today() + timedelta(days=1), datetime.min.time())
+            if self._stop.wait((midnight - datetime.now()).total_seconds() + 1):
+                return
+            try:
+                with self.app.app_context():
+                    self.run_if_due()
+            except Exception:
+                log.exception("Overdue run failed")
+
+
+def outstanding_fines(today=None):
+    """Fines owed right now on loans that are still out."""
+    config = current_app.config
+    return config["BORROWINGS"].indexes["fines"].owed(
+        today or date.today(), config["FINE_PER_DAY"]
+    )
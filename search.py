@@ -0,0 +1,160 @@
+"""Inverted n-gram index for the catalogue and member search boxes, and
+prefix lookups for the typeahead boxes.
+
+Every indexed field value is lowercased once, when the record is written,
+and split into overlapping trigrams. A search looks up the rarest trigram
+of the query, then checks each candidate with a plain substring test on
+the pre-lowercased text. Results match the old ``query in field.lower()``
+scan exactly, but a search costs time proportional to the candidates
+instead of the whole table.
+
+Typeahead (as-you-type lookups) only needs values that start with what
+was typed. :func:`prefix_index` keeps those values lowercased in a
+:class:`store.SortedIndex`, where every match for a prefix sits in one
+contiguous run: a lookup is a bisect to the run and a read of the first
+few entries, however big the table.
+"""
+from array import array
+from itertools import islice
+
+from store import SortedIndex, scanned
+
+# Sorts after any character a prefix can be followed by
+PREFIX_END = "\U0010ffff"
+
+GRAM = 3
+
+
+def grams(text):
+    """Distinct trigrams of ``text``; shorter text is its own gram."""
+    if len(text) < GRAM:
+        return {text} if text else set()
+    return {text[i:i + GRAM] for i in range(len(text) - GRAM + 1)}
+
+
+class TextIndex:
+    """Substring index over some text fields of a table's records.
+
+    ``fields`` maps field name to a ranking weight. It plugs into
+    :class:`store.Table` like any other index, so it is kept up to date by
+    add, update and delete.
+
+    Posting lists are compact ``array`` objects that are only ever
+    appended to. Entries left behind by edits and deletes are skipped at
+    search time, and the postings are rebuilt once those stale entries
+    outnumber the live ones.
+    """
+
+    def __init__(self, fields):
+        self.weights = dict(fields)
+        self.fields = tuple(self.weights)
+        self._postings = {}
+        self._text = {}
+        self._live = 0
+        self._stale = 0
+
+    def _lowered(self, record):
+        return tuple(str(getattr(record, field) or "").lower() for field in self.fields)
+
+    def _post(self, postings, id, new_grams):
+        for gram in new_grams:
+            posting = postings.get(gram)
+            if posting is None:
+                posting = postings[gram] = array("q")
+            posting.append(id)
+        self._live += len(new_grams)
+
+    def add(self, record):
+        text = self._lowered(record)
+        self._text[record.id] = text
+        self._post(self._postings, record.id, set().union(*map(grams, text)))
+
+    def remove(self, record):
+        text = self._text.pop(record.id, None)
+        if text is not None:
+            n = len(set().union(*map(grams, text)))
+            self._live -= n
+            self._stale += n
+            if self._stale > max(self._live, 1024):
+                self._rebuild()
+
+    def _rebuild(self):
+        # Built aside and swapped in, so concurrent searches never see it
+        # half-filled
+        postings = {}
+        self._live = self._stale = 0
+        for id, text in self._text.items():
+            self._post(postings, id, set().union(*map(grams, text)))
+        self._postings = postings
+
+    def _candidates(self, query):
+        if len(query) >= GRAM:
+            # Every match contains every trigram of the query, so the
+            # rarest one gives the smallest candidate list
+            postings = [self._postings.get(g) for g in grams(query)]
+            if not all(postings):
+                return ()
+            return min(postings, key=len)
+        # A short query matches exactly the records that have a gram
+        # containing it. The gram vocabulary does not grow with the table.
+        ids = set()
+        for gram, posting in list(self._postings.items()):
+            if query in gram:
+                ids.update(posting)
+        return ids
+
+    def search(self, query):
+        """Return ids of records matching ``query``, best match first.
+
+        Matches are case-insensitive substrings of any indexed field.
+        Whole-field matches rank above word-prefix matches, which rank
+        above matches inside a word; ties keep id order.
+        """
+        query = query.lower()
+        if not query:
+            return []
+        texts = self._text
+        weights = tuple(self.weights.values())
+        word = " " + query
+        scores = {}
+        for id in self._candidates(query):
+            if id in scores:
+                continue
+            text = texts.get(id)
+            if text is None:
+                continue
+            score = 0
+            for weight, value in zip(weights, text):
+                if query not in value:
+                    continue
+                if value == query:
+                    score += 3 * weight
+                elif value.startswith(query) or word in value:
+                    score += 2 * weight
+                else:
+                    score += weight
+            scores[id] = score
+        scanned.count += len(scores)
+        ranked = sorted((-score, id) for id, score in scores.items() if score)
+        return [id for _, id in ranked]
+
+
+def prefix_index(field):
+    """A SortedIndex of records by lowercased ``field``, for :func:`prefix_matches`."""
+    return SortedIndex(key=lambda record: (getattr(record, field) or "").lower(), fields=(field,))
+
+
+def prefix_matches(index, prefix, limit, where=None, scan_limit=None):
+    """Up to ``limit`` records whose key starts with ``prefix``, in key order.
+
+    ``where`` filters the matches; at most ``scan_limit`` entries are read
+    looking for them, so a rare filter cannot turn a lookup into a scan.
+    """
+    prefix = prefix.lower()
+    entries = index.scan(start=(prefix,), stop=(prefix + PREFIX_END,))
+    if scan_limit is not None:
+        entries = islice(entries, scan_limit)
+    records = (record for _, record in entries)
+    if where is not None:
+        records = filter(where, records)
+    return list(islice(records, limit))
@@ -0,0 +1,203 @@
+"""Multi-process mode: several workers serving one SQL database.
+
+Under gunicorn (see gunicorn.conf.py) each worker is its own process with
+its own in-memory tables, indexes and page cache, loaded from the
+database when it starts. The database stays the one authoritative copy.
+Every write still goes through to it. The SQL backend also appends
+``(table, id)`` to a change log in the same transaction (see
+storage.SQLBackend.share).
+
+:class:`ChangeFeed` follows that log. Before each request, and at the
+start of each transaction, it reads the entries past the last one the
+worker has seen and reloads just those rows. Reloading a row bumps its
+table's version, and that version is how the worker's page cache,
+choice lists and typeahead bodies notice the change (see cache.py). A
+worker with nothing new to apply pays one indexed query. A request that
+finds one of the worker's own transactions running does not wait for
+it: it reads the tables as they are, and the transaction catches up.
+
+Writes stay atomic across workers. A transaction first takes the
+database's write lock (``BEGIN IMMEDIATE`` in SQLite, an advisory lock in
+PostgreSQL) and catches up while holding it. So "is a copy on the shelf?
+then lend it" reads the latest state, and no other worker can write in
+between. Ids come from a sequence table in the database
+(:class:`SharedSequence`), so two workers never hand out the same one.
+
+The API's ETags are built from the log as well: from the sequence number
+of the last change to each table, plus an epoch kept in the database.
+Every worker that has caught up gives the same ETag for the same data,
+so a client gets its 304 whichever worker answers.
+
+The memory and journal backends keep their data inside one process and
+cannot be shared.
+"""
+import logging
+import os
+from collections import defaultdict
+
+from store import Sequence, write_lock
+
+log = logging.getLogger(__name__)
+
+# Meta keys: the ETag epoch, and how far the change log has been pruned
+EPOCH = "shared_epoch"
+PRUNED = "changes_pruned"
+
+# Entries kept when the change log is pruned. A worker that falls further
+# behind than this (one idle through a big import) reloads everything.
+KEEP_CHANGES = 100_000
+
+
+class SharedSequence(Sequence):
+    """Id allocator kept in the database, so every worker draws from it.
+
+    Each :meth:`next` or :meth:`reserve` is one UPDATE ... RETURNING. That
+    costs a round trip, but only writes allocate ids. :meth:`advance`
+    touches the database only for ids past the highest one this worker
+    knows to be taken, such as explicit ids in a bulk import.
+    """
+
+    def __init__(self, backend, name, last=0):
+        super().__init__(last)
+        self.backend = backend
+        self.name = name
+        self._claimed = backend.claim_ids(name, last)
+
+    def next(self):
+        return self.reserve(1)[0]
+
+    def reserve(self, count):
+        if count <= 0:
+            return range(0)
+        last = self.backend.allocate_ids(self.name, count)
+        self.seen(last)
+        super().advance(last)
+        return range(last - count + 1, last + 1)
+
+    def advance(self, id):
+        super().advance(id)
+        if id > self._claimed:
+            self._claimed = self.backend.claim_ids(self.name, id)
+
+    def seen(self, id):
+        """Note that ``id`` was handed out already, by any worker."""
+        if id > self._claimed:
+            self._claimed = id
+
+
+class ChangeFeed:
+    """Keeps this worker's tables in step with the database's change log."""
+
+    def __init__(self, backend, lock=write_lock):
+        if not hasattr(backend, "share"):
+            raise ValueError(
+                "Several workers need a shared database: set DATABASE_URL "
+                "to a sqlite:/// or postgresql:// URL"
+            )
+        self.backend = backend
+        self.lock = lock
+        self.tables = {}
+        # Read before the tables load, so changes made while they load
+        # are applied again rather than missed
+        self.last = backend.share()
+        with backend.transaction():
+            epoch = backend.get_meta(EPOCH)
+            if epoch is None:
+                epoch = os.urandom(4).hex()
+                backend.set_meta(EPOCH, epoch)
+        self.epoch = epoch
+        self.pruned = int(backend.get_meta(PRUNED) or 0)
+        # Table name -> sequence number of the last change to it, which
+        # is the same in every worker that has caught up. Tables whose
+        # changes were all pruned count from the pruning point.
+        pruned = self.pruned
+        self.versions = defaultdict(lambda: pruned, backend.last_changes())
+
+    def attach(self, *tables):
+        """Follow changes to ``tables`` and give them shared id sequences."""
+        for table in tables:
+            table.ids = SharedSequence(self.backend, table.name, table.ids.last)
+            self.tables[table.name] = table
+
+    def refresh(self, wait=True):
+        """Apply the changes logged since the last call; return how many
+        rows changed.
+
+        With ``wait=False``, skip the refresh rather than wait while one
+        of this worker's transactions holds the write lock. Readers use
+        that, so they never block on writers; the transaction catches up
+        itself, and the next request applies the rest.
+        """
+        # Unlocked first: when nothing changed, readers do not queue
+        if not self.backend.changes(self.last):
+            return 0
+        # The write lock keeps this worker's own transactions out while
+        # rows are replaced, so none sees its half-done work overwritten
+        if not self.lock.acquire(blocking=wait):
+            return 0
+        try:
+            changes = self.backend.changes(self.last)
+            if not changes:
+                return 0
+            pruned = int(self.backend.get_meta(PRUNED) or 0)
+            if pruned > self.last:
+                changed = self._reload()
+                # Any change missed was at or before the pruning point
+                for name in self.tables:
+                    self.versions[name] = max(self.versions[name], pruned)
+            else:
+                changed = self._apply(changes)
+            # Versions move after the rows: a reader that sees the new
+            # version also sees the new data
+            for seq, name, _ in changes:
+                self.versions[name] = seq
+            self.last = changes[-1][0]
+            self.pruned = max(self.pruned, pruned)
+        finally:
+            self.lock.release()
+        return changed
+
+    def _apply(self, changes):
+        touched = defaultdict(set)
+        for _, name, id in changes:
+            touched[name].add(id)
+        changed = 0
+        for name, ids in touched.items():
+            table = self.tables.get(name)
+            if table is None:
+                continue
+            stored = {record.id: record for record in self.backend.fetch(name, ids)}
+            if stored:
+                table.ids.seen(max(stored))
+            # In id order, so new holds join their queues in the order placed
+            for id in sorted(ids):
+                changed += table.apply(id, stored.get(id))
+        return changed
+
+    def _reload(self):
+        """Compare every table with the database, for a worker that missed
+        pruned entries."""
+        log.warning("Change log pruned past entry %d; reloading all tables", self.last)
+        changed = 0
+        for name, table in self.tables.items():
+            stored = {record.id: record for record in self.backend.fetch(name)}
+            if stored:
+                table.ids.seen(max(stored))
+            for id in [id for id in table.ids_after() if id not in stored]:
+                changed += table.apply(id, None)
+            for id, record in stored.items():
+                changed += table.apply(id, record)
+        return changed
+
+    def prune(self):
+        """Drop old log entries once there are twice :data:`KEEP_CHANGES`;
+        called inside a transaction."""
+        if self.last - self.pruned > 2 * KEEP_CHANGES:
+            upto = self.last - KEEP_CHANGES
+            self.backend.prune_changes(upto)
+            self.backend.set_meta(PRUNED, str(upto))
+            self.pruned = upto
+
+    def version(self, table):
+        """Sequence number of the last change to ``table``."""
+        return self.versions[table.name]
@@ -45,6 +45,43 @@ document.addEventListener('DOMContentLoaded', function() {
         }, 5000);
     });
 
+    // Typeahead boxes: suggest records from a lookup route as the user
+    // types, and keep the chosen one's id in the hidden field
+    document.querySelectorAll('input.typeahead').forEach(input => {
+        const target = document.getElementById(input.dataset.target);
+        const options = document.getElementById(input.getAttribute('list'));
+        const ids = new Map();
+        if (input.value && target.value) {
+            ids.set(input.value, target.value);
+        }
+        let timeoutId;
+
+        const suggest = () => {
+            const url = new URL(input.dataset.source, window.location.origin);
+            url.searchParams.set('q', input.value);
+            fetch(url)
+                .then(response => response.json())
+                .then(data => {
+                    options.innerHTML = '';
+                    data.items.forEach(item => {
+                        ids.set(item.label, item.id);
+                        const option = document.createElement('option');
+                        option.value = item.label;
+                        options.appendChild(option);
+                    });
+                });
+        };
+
+        input.addEventListener('input', () => {
+            // A suggestion picked from the list fills in its exact label
+            target.value = ids.get(input.value) || '';
+            clearTimeout(timeoutId);
+            if (!target.value) {
+                timeoutId = setTimeout(suggest, 200);
+            }
+        });
+    });
+
     // Search form handling
     const searchForm = document.getElementById('searchForm');
     if (searchForm) {
@@ -84,7 +121,7 @@ function updateStatusBadges() {
     const badges = document.querySelectorAll('.status-badge');
     badges.forEach(badge => {
         const status = badge.textContent.trim().toLowerCase();
-        badge.classList.remove('badge-available', 'badge-borrowed', 'badge-overdue', 'badge-returned');
+        badge.classList.remove('badge-available', 'badge-borrowed', 'badge-overdue', 'badge-returned', 'badge-on-hold');
         
         if (status === 'available') {
             badge.classList.add('badge-available');
@@ -94,6 +131,8 @@ function updateStatusBadges() {
             badge.classList.add('badge-overdue');
         } else if (status === 'returned') {
             badge.classList.add('badge-returned');
+        } else if (status === 'on hold' || status === 'ready') {
+            badge.classList.add('badge-on-hold');
         }
     });
 }
@@ -0,0 +1,602 @@
+"""In-memory record store used by the route handlers.
+
+Records (the model objects from models.py) are kept in a dict keyed by
+their ``id`` so that lookups, updates and deletes are O(1). Python dicts
+preserve insertion order, and ids are handed out in increasing order, so
+iterating a table still yields records in the order they were added.
+
+Concurrency: all writers serialize on ``write_lock``, which handlers also
+hold around check-then-set sequences such as "is the book available? then
+lend it". Readers never take the lock. Everything a reader touches is
+either changed by a single operation that the GIL makes atomic (dict and
+list item assignment, ``dict.update``, ``list.insert``), or rebuilt off
+to the side and swapped in with one assignment. Long ordered scans read
+in short slices and re-seek between them, so concurrent inserts cannot
+make them skip or repeat entries.
+
+Rollback: a transaction that fails undoes its storage writes, and
+:func:`undoable` undoes the matching in-memory changes, so the tables
+never keep half of a "lend a copy, record the loan" step.
+"""
+import bisect
+import threading
+from contextlib import contextmanager
+
+# Shared by every table so a handler can update several tables atomically
+write_lock = threading.RLock()
+
+# Entries a SortedIndex scan copies per step
+SCAN_CHUNK = 64
+
+# Backend meta key holding the highest id a table has handed out
+LAST_ID = "last_id:{}"
+
+
+class ScanCounter(threading.local):
+    """Records read by the current thread, for per-request metrics.
+
+    Scans add to ``count`` once per chunk or per call, not once per
+    record, so the counter costs next to nothing when nobody reads it.
+    """
+    count = 0
+
+
+scanned = ScanCounter()
+
+
+class UndoLog(threading.local):
+    """Steps that reverse the current thread's table writes, oldest first;
+    None outside :func:`undoable`."""
+    steps = None
+
+
+undo_log = UndoLog()
+
+
+@contextmanager
+def undoable():
+    """Reverse every table write made inside the block if it raises.
+
+    Held under ``write_lock`` (see app.transaction), so no other writer
+    sees or builds on the changes before they are undone. A nested block
+    joins the outermost one, which is the one storage rolls back.
+    """
+    if undo_log.steps is not None:
+        yield
+        return
+    undo_log.steps = []
+    try:
+        yield
+    except BaseException:
+        steps, undo_log.steps = undo_log.steps, None
+        for step in reversed(steps):
+            step()
+        raise
+    finally:
+        undo_log.steps = None
+
+
+class Sequence:
+    """Thread-safe, monotonic id allocator.
+
+    Ids are never reused, even if the record holding the highest id is
+    deleted.
+    """
+
+    def __init__(self, last=0):
+        self._last = last
+        self._lock = threading.Lock()
+
+    @property
+    def last(self):
+        return self._last
+
+    def next(self):
+        """Allocate and return the next id."""
+        with self._lock:
+            self._last += 1
+            return self._last
+
+    def reserve(self, count):
+        """Allocate ``count`` consecutive ids for a batch insert."""
+        with self._lock:
+            first = self._last + 1
+            self._last += count
+        return range(first, first + count)
+
+    def advance(self, id):
+        """Make sure ids handed out later are greater than ``id``."""
+        with self._lock:
+            if id > self._last:
+                self._last = id
+
+
+class Index:
+    """Secondary index from the value of one field to the records holding it.
+
+    Each bucket is a dict keyed by record id, so adding and removing a
+    record is O(1) and a lookup costs time proportional to its result.
+    """
+
+    def __init__(self, field):
+        self.field = field
+        self.fields = (field,)
+        self._buckets = {}
+
+    def add(self, record):
+        bucket = self._buckets.setdefault(getattr(record, self.field), {})
+        bucket[record.id] = record
+
+    def remove(self, record):
+        value = getattr(record, self.field)
+        bucket = self._buckets.get(value)
+        if bucket is not None:
+            bucket.pop(record.id, None)
+            if not bucket:
+                del self._buckets[value]
+
+    def get(self, value):
+        """Return the records whose field equals ``value``."""
+        records = list(self._buckets.get(value, {}).values())
+        scanned.count += len(records)
+        return records
+
+    def ids(self, value):
+        """Set-like view of the ids of records whose field equals ``value``."""
+        return self._buckets.get(value, {}).keys()
+
+    def count(self, value):
+        return len(self._buckets.get(value, ()))
+
+
+class FacetIndex(Index):
+    """An :class:`Index` that also keeps its distinct values sorted.
+
+    Meant for fields with few distinct values, such as a book's category,
+    which the filter dropdowns list with a count next to each. The sorted
+    list only changes when a value gains its first record or loses its
+    last one. It is then rebuilt and swapped in, so readers never sort.
+
+    Each bucket's ids are also kept in a sorted list, so a filtered
+    listing can page through a bucket in id order (see
+    :meth:`Table.match_after`) without sorting it.
+    """
+
+    def __init__(self, field):
+        super().__init__(field)
+        self._values = []
+        self._ordered = {}
+
+    def add(self, record):
+        value = getattr(record, self.field)
+        if value not in self._buckets:
+            values = self._values[:]
+            bisect.insort(values, value)
+            self._values = values
+        super().add(record)
+        ordered = self._ordered.setdefault(value, [])
+        if not ordered or record.id > ordered[-1]:
+            ordered.append(record.id)
+        else:
+            bisect.insort(ordered, record.id)
+
+    def add_many(self, records):
+        """Add a batch with one merge per value instead of one insort per
+        record."""
+        new = {}
+        for record in records:
+            new.setdefault(getattr(record, self.field), []).append(record.id)
+        if not new.keys() <= set(self._values):
+            self._values = sorted(new.keys() | set(self._values))
+        for record in records:
+            Index.add(self, record)
+        for value, ids in new.items():
+            # Merged aside and swapped in, so running scans keep their list
+            ordered = self._ordered.get(value, []) + ids
+            ordered.sort()
+            self._ordered[value] = ordered
+
+    def remove(self, record):
+        super().remove(record)
+        value = getattr(record, self.field)
+        ordered = self._ordered.get(value)
+        if ordered:
+            pos = bisect.bisect_left(ordered, record.id)
+            if pos < len(ordered) and ordered[pos] == record.id:
+                del ordered[pos]
+            if not ordered:
+                del self._ordered[value]
+        if value not in self._buckets and value in self._values:
+            self._values = [v for v in self._values if v != value]
+
+    def ids_after(self, value, after=None):
+        """Yield the ids holding ``value`` in ascending order, starting
+        after ``after``.
+
+        Reads the bucket in short slices and re-seeks between them, like
+        :meth:`SortedIndex.scan`, so only the ids consumed are visited.
+        """
+        while True:
+            ordered = self._ordered.get(value, ())
+            pos = 0 if after is None else bisect.bisect_right(ordered, after)
+            chunk = ordered[pos:pos + SCAN_CHUNK]
+            scanned.count += len(chunk)
+            for id in chunk:
+                # Skip ids a writer has moved out of the bucket since the slice
+                if id in self._buckets.get(value, ()):
+                    yield id
+            if len(chunk) < SCAN_CHUNK:
+                return
+            after = chunk[-1]
+
+    def values(self):
+        """Distinct values, sorted."""
+        return self._values
+
+    def facets(self):
+        """``(value, count)`` for each distinct value, sorted by value."""
+        buckets = self._buckets
+        return [(value, len(buckets.get(value, ()))) for value in self._values]
+
+
+class SortedIndex:
+    """Records kept in order of ``key(record)``, optionally filtered.
+
+    Only records for which ``where(record)`` is true are indexed. The
+    index is refreshed whenever one of ``fields`` changes. Entries are
+    ``(key, id)`` tuples in a sorted list, so range queries and counts
+    are a bisect rather than a pass over the table.
+    """
+
+    def __init__(self, key, fields, where=None):
+        self.key = key
+        self.fields = tuple(fields)
+        self.where = where
+        self._entries = []
+        self._keys = {}
+        self._records = {}
+
+    def add(self, record):
+        if self.where is not None and not self.where(record):
+            return
+        entry = (self.key(record), record.id)
+        bisect.insort(self._entries, entry)
+        self._keys[record.id] = entry
+        self._records[record.id] = record
+
+    def add_many(self, records):
+        """Add a batch with one merge instead of one insort per record."""
+        new = []
+        for record in records:
+            if self.where is None or self.where(record):
+                entry = (self.key(record), record.id)
+                new.append(entry)
+                self._keys[record.id] = entry
+                self._records[record.id] = record
+        if new:
+            # Merged aside and swapped in, so running scans keep their list
+            entries = self._entries + new
+            entries.sort()
+            self._entries = entries
+
+    def remove(self, record):
+        entry = self._keys.pop(record.id, None)
+        if entry is not None:
+            del self._entries[bisect.bisect_left(self._entries, entry)]
+            del self._records[record.id]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def scan(self, start=None, stop=None, reverse=False):
+        """Yield ``(key, record)`` pairs between two entry bounds.
+
+        Bounds are ``(key, id)`` entries (a keyset cursor) or ``(key,)``.
+        Both are exclusive. Walks in key order, or from ``start``
+        downwards when ``reverse`` is set; ``stop`` is ignored then.
+        Only the entries actually consumed are visited, so the caller
+        can stop after one page.
+        """
+        while True:
+            entries = self._entries
+            if reverse:
+                pos = len(entries) if start is None else bisect.bisect_left(entries, start)
+                chunk = entries[max(pos - SCAN_CHUNK, 0):pos]
+                chunk.reverse()
+            else:
+                pos = 0 if start is None else bisect.bisect_right(entries, start)
+                chunk = entries[pos:pos + SCAN_CHUNK]
+                if stop is not None:
+                    del chunk[bisect.bisect_left(chunk, stop):]
+            scanned.count += len(chunk)
+            for entry in chunk:
+                # Skip entries a writer has removed or re-keyed since the slice
+                record = self._records.get(entry[1])
+                if record is not None and self._keys.get(entry[1]) == entry:
+                    yield entry[0], record
+            if len(chunk) < SCAN_CHUNK:
+                return
+            start = chunk[-1]
+
+
+class Table:
+    """A collection of records indexed by their ``id`` field.
+
+    ``indexes`` names fields that get a secondary :class:`Index`. Other
+    indexes can be attached with :meth:`add_index`. All of them are kept
+    in sync by :meth:`add`, :meth:`update` and :meth:`delete`.
+
+    When a ``backend`` (see storage.py) is given, every change is written
+    to it before the in-memory copy is touched, so a failed write leaves
+    the table unchanged. Inside :func:`undoable` each change also logs
+    how to reverse it, so a failure later in the same transaction leaves
+    every table as it was when the transaction began.
+    """
+
+    def __init__(self, name, records=(), indexes=(), backend=None, lock=write_lock):
+        self.name = name
+        self.backend = backend
+        self.lock = lock
+        self._rows = {}
+        self.indexes = {field: Index(field) for field in indexes}
+        for record in records:
+            self._rows[record.id] = record
+            for index in self.indexes.values():
+                index.add(record)
+        # Ids in ascending order, for keyset pagination. Deleted ids are
+        # skipped when read and compacted away in bulk.
+        self._order = sorted(self._rows)
+        self._deleted = 0
+        # Seeded once here; after that allocation never looks at the rows.
+        # The highest id ever handed out is kept in the backend too, since
+        # the record holding it may have been deleted before a restart.
+        last = max(self._rows, default=0)
+        if backend is not None:
+            last = max(last, int(backend.get_meta(LAST_ID.format(name)) or 0))
+        self.ids = Sequence(last)
+        self._kept_last = last
+        # Bumped by every change, so readers can tell a table is unchanged
+        # (the JSON API builds its ETags from it)
+        self.version = 0
+
+    def add_index(self, name, index):
+        """Attach ``index`` under ``name`` and fill it from existing rows."""
+        with self.lock:
+            for record in self._rows.values():
+                index.add(record)
+            self.indexes = {**self.indexes, name: index}
+        return index
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __iter__(self):
+        # Walk the id list rather than the dict, which a concurrent add or
+        # delete would invalidate mid-iteration
+        rows = self._rows
+        for id in self.ids_after():
+            record = rows.get(id)
+            if record is not None:
+                yield record
+
+    def __contains__(self, id):
+        return id in self._rows
+
+    def get(self, id):
+        """Return the record with the given id, or None."""
+        return self._rows.get(id)
+
+    def add(self, record):
+        with self.lock:
+            return self._add(record)
+
+    def _add(self, record):
+        if record.id in self._rows:
+            raise KeyError(f"{self.name}: duplicate id {record.id}")
+        if self.backend is not None:
+            self.backend.save(self.name, record)
+        self._undo(self._remove, record.id)
+        return self._insert(record)
+
+    def _undo(self, step, *args):
+        steps = undo_log.steps
+        if steps is not None:
+            steps.append(lambda: step(*args))
+
+    def _insert(self, record, indexed=True):
+        self._rows[record.id] = record
+        self.ids.advance(record.id)
+        order = self._order
+        if not order or record.id > order[-1]:
+            order.append(record.id)
+        else:
+            # A deleted id stays in the list until it is compacted, so a
+            # record put back (an undone delete) may find it still there
+            pos = bisect.bisect_left(order, record.id)
+            if pos == len(order) or order[pos] != record.id:
+                order.insert(pos, record.id)
+        if indexed:
+            for index in self.indexes.values():
+                index.add(record)
+        self.version += 1
+        return record
+
+    def add_many(self, records):
+        """Add a batch of new records with one backend write.
+
+        Raises KeyError, before anything is written, if any id is taken.
+        """
+        with self.lock:
+            seen = set()
+            for record in records:
+                if record.id in self._rows or record.id in seen:
+                    raise KeyError(f"{self.name}: duplicate id {record.id}")
+                seen.add(record.id)
+            if self.backend is not None:
+                self.backend.save_many(self.name, records)
+            self._undo(self._remove_many, [record.id for record in records])
+            for record in records:
+                self._insert(record, indexed=False)
+            for index in self.indexes.values():
+                if hasattr(index, "add_many"):
+                    index.add_many(records)
+                else:
+                    for record in records:
+                        index.add(record)
+        return records
+
+    def update(self, record, **changes):
+        """Apply ``changes`` to a stored record in place."""
+        with self.lock:
+            return self._update(record, changes)
+
+    def _update(self, record, changes):
+        if self.backend is not None:
+            self.backend.save(self.name, record.replace(**changes))
+        self._undo(self._change, record, {name: getattr(record, name) for name in changes})
+        return self._change(record, changes)
+
+    def _change(self, record, changes):
+        moved = [
+            index for index in self.indexes.values()
+            if any(
+                field in changes and changes[field] != getattr(record, field)
+                for field in index.fields
+            )
+        ]
+        for index in moved:
+            index.remove(record)
+        record.update(changes)
+        for index in moved:
+            index.add(record)
+        self.version += 1
+        return record
+
+    def delete(self, id):
+        """Remove and return the record with the given id, or None."""
+        with self.lock:
+            return self._delete(id)
+
+    def _delete(self, id):
+        if self.backend is not None and id in self._rows:
+            # Deleting may take the highest id out of storage: keep it first
+            last = self.ids.last
+            if last > self._kept_last:
+                self.backend.set_meta(LAST_ID.format(self.name), str(last))
+                self._kept_last = last
+            self.backend.delete(self.name, id)
+        record = self._remove(id)
+        if record is not None:
+            self._undo(self._insert, record)
+        return record
+
+    def _remove_many(self, ids):
+        for id in ids:
+            self._remove(id)
+
+    def _remove(self, id):
+        record = self._rows.pop(id, None)
+        if record is not None:
+            for index in self.indexes.values():
+                index.remove(record)
+            self.version += 1
+            self._deleted += 1
+            if self._deleted > len(self._rows):
+                self._order = [i for i in self._order if i in self._rows]
+                self._deleted = 0
+        return record
+
+    def apply(self, id, stored):
+        """Bring the record ``id`` in line with ``stored``, its row as
+        another process left it (None if deleted), without writing it
+        back. Returns True if anything changed.
+
+        Used in multi-process mode (see shared.py). Only fields that
+        differ are touched, so replaying a change this process made
+        itself costs nothing and keeps the version.
+        """
+        with self.lock:
+            record = self._rows.get(id)
+            if stored is None:
+                return self._remove(id) is not None
+            if record is None:
+                self._insert(stored)
+                return True
+            changes = {
+                name: value for name, value in stored.to_dict().items()
+                if getattr(record, name) != value
+            }
+            if changes:
+                self._change(record, changes)
+            return bool(changes)
+
+    def ids_after(self, after=None):
+        """Yield ids in ascending order, starting after ``after``.
+
+        Reads the id list in short slices and re-seeks between them, like
+        :meth:`SortedIndex.scan`, so a deep cursor costs one bisect.
+        """
+        while True:
+            order = self._order
+            pos = 0 if after is None else bisect.bisect_right(order, after)
+            chunk = order[pos:pos + SCAN_CHUNK]
+            scanned.count += len(chunk)
+            for id in chunk:
+                # Skip ids deleted but not yet compacted out of the list
+                if id in self._rows:
+                    yield id
+            if len(chunk) < SCAN_CHUNK:
+                return
+            after = chunk[-1]
+
+    def lookup(self, field, value):
+        """Return the records whose indexed ``field`` equals ``value``."""
+        return self.indexes[field].get(value)
+
+    def count(self, field, value):
+        return self.indexes[field].count(value)
+
+    def match_after(self, after=None, **criteria):
+        """Yield ids of records matching every ``field=value`` pair in
+        ascending order, starting after ``after``.
+
+        Walks the smallest bucket of the id-ordered indexes among the
+        fields (see :meth:`FacetIndex.ids_after`) and checks the other
+        fields by membership, so a page reads its own ids rather than
+        every match.
+        """
+        ordered = [field for field in criteria if hasattr(self.indexes[field], "ids_after")]
+        field = min(ordered, key=lambda field: self.indexes[field].count(criteria[field]))
+        others = [(self.indexes[f], value) for f, value in criteria.items() if f != field]
+        for id in self.indexes[field].ids_after(criteria[field], after):
+            if all(id in index.ids(value) for index, value in others):
+                yield id
+
+    def match_count(self, **criteria):
+        """How many records match every ``field=value`` pair."""
+        buckets = sorted(
+            (self.indexes[field].ids(value) for field, value in criteria.items()),
+            key=len
+        )
+        ids = buckets[0]
+        if len(buckets) == 1:
+            return len(ids)
+        scanned.count += len(ids)
+        for bucket in buckets[1:-1]:
+            ids = filter(bucket.__contains__, ids)
+        return sum(map(buckets[-1].__contains__, ids))
+
+    def match_ids(self, **criteria):
+        """Ids of records matching every ``field=value`` pair.
+
+        Intersects the index buckets, starting from the smallest one.
+        """
+        buckets = sorted(
+            (self.indexes[field].ids(value) for field, value in criteria.items()),
+            key=len
+        )
+        ids = set(buckets[0])
+        scanned.count += len(ids)
+        for bucket in buckets[1:]:
+            ids.intersection_update(bucket)
+        return ids